@@ -0,0 +1,121 @@
+"""
+Read CCDAs straight out of zip and tar archives, without extracting them.
+
+`members` lists the `.xml` members of an archive and `open_member` opens one
+for reading, so the parser reads from the decompression stream and nothing is
+written to disk. `batch.parse_many` (and so `export` and `ccda-parse`) accepts
+archives anywhere it accepts files::
+
+    for result in batch.parse_many(["partner.zip", "bundle.tar.gz"], workers=8):
+        print(result.path)  # "partner.zip!CCDAs/patient1.xml"
+
+Zip members can be read in any order, so each worker opens the archive itself
+and decompresses its own members in parallel. Tar archives (compressed or not)
+can only be read in order, so they're decompressed as one stream and each
+member's bytes are handed to the workers.
+"""
+
+from collections import OrderedDict, namedtuple
+import io
+import os
+import tarfile
+import threading
+import zipfile
+
+# `data` is None for zip members, which are opened by name, and the member's
+# bytes (or, while it's the current member, a file object) for tar members
+Member = namedtuple("Member", "archive name data")
+
+MAX_OPEN_ZIPS = 8  # per process
+
+_zips = OrderedDict()  # path -> ZipFile opened by this process
+_zips_lock = threading.Lock()
+_zips_pid = os.getpid()
+
+
+def is_archive(path):
+    """
+    Whether `path` is a zip or tar file (`.xml` files are never checked).
+    """
+    if str(path).lower().endswith(".xml") or not os.path.isfile(path):
+        return False
+    return zipfile.is_zipfile(path) or tarfile.is_tarfile(path)
+
+
+def _is_ccda(name):
+    return name.lower().endswith(".xml")
+
+
+def members(path, read=True):
+    """
+    Yield a `Member` for each `.xml` member of the archive at `path`, in order.
+
+    Tar members are streamed: with `read`, each one's bytes are read into
+    `data`, otherwise `data` is a file object that can only be read until the
+    next member is yielded.
+    """
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            names = [
+                info.filename
+                for info in archive.infolist()
+                if not info.is_dir() and _is_ccda(info.filename)
+            ]
+        for name in names:
+            yield Member(path, name, None)
+        return
+
+    with tarfile.open(path, "r|*") as archive:  # stream, don't seek
+        for info in archive:
+            if info.isfile() and _is_ccda(info.name):
+                member = archive.extractfile(info)
+                yield Member(path, info.name, member.read() if read else member)
+
+
+def member_path(member):
+    """
+    Get the name of a member as `archive!member`.
+    """
+    return f"{member.archive}!{member.name}"
+
+
+def _zip_file(path):
+    """
+    Get this process's open `ZipFile` for `path`, keeping the most recently used
+    `MAX_OPEN_ZIPS` open.
+    """
+    global _zips_pid
+    key = os.path.abspath(path)
+    with _zips_lock:
+        if _zips_pid != os.getpid():  # forked, the parent's handles share offsets
+            _zips.clear()
+            _zips_pid = os.getpid()
+
+        archive = _zips.get(key)
+        if archive is None:
+            archive = _zips[key] = zipfile.ZipFile(path)
+            while len(_zips) > MAX_OPEN_ZIPS:
+                _zips.popitem(last=False)[1].close()
+        _zips.move_to_end(key)
+        return archive
+
+
+def open_member(member):
+    """
+    Open a `Member` as a binary file object, decompressing as it's read.
+    """
+    if member.data is None:
+        return _zip_file(member.archive).open(member.name)
+    if isinstance(member.data, (bytes, bytearray, memoryview)):
+        return io.BytesIO(member.data)
+    return member.data
+
+
+def close_all():
+    """
+    Close the zip files this process has open.
+    """
+    with _zips_lock:
+        for archive in _zips.values():
+            archive.close()
+        _zips.clear()
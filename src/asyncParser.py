@@ -0,0 +1,236 @@
+"""
+Parse CCDAs from asyncio code without blocking the event loop.
+
+Files are read in the loop's default executor, the XML is parsed in `executor`
+(a thread or process pool, or the default executor) and every `Parser` call,
+code lookups included, runs in a thread of the parser's own, so its database
+connection is only ever used by that thread. `parse_many_async` keeps at most
+`concurrency` documents in flight::
+
+    async with await asyncParser.parse_async(body) as patient:
+        fields = await patient.get_fields(["name", "dob"])
+
+    async for result in asyncParser.parse_many_async(paths, concurrency=32):
+        ...
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+import batch
+import codeDatabase
+import parser
+
+DEFAULT_CONCURRENCY = 32
+
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _parse_document(source, options):
+    """
+    Parse `source` (bytes, or with `streaming` also a path) into the document dict.
+
+    Module level so it can run in a process pool.
+    """
+    return parser.load_document(source, **options)
+
+
+def _parser_thread():
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix="AsyncParser")
+
+
+class AsyncParser:
+    """
+    Wraps a `Parser` so each call runs in a worker thread.
+
+    Every call on one `AsyncParser` runs in the same thread, one at a time: a
+    `Parser` isn't thread-safe, and its pooled database connection belongs to the
+    thread that opened it (see `codeDatabase.ConnectionProvider`). Different
+    documents run in parallel. `thread` is the single-thread executor to use, if
+    the `Parser` was made in one; otherwise the `Parser` shouldn't have queried
+    the database yet.
+    """
+
+    def __init__(self, patient, thread=None):
+        self.parser = patient
+        self._thread = _parser_thread() if thread is None else thread
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._thread, functools.partial(func, *args))
+
+    async def get(self, field):
+        """
+        Get a `Parser` property, or call a method that takes no arguments (like
+        `insurance`).
+        """
+        return await self._run(_get_field, self.parser, field)
+
+    async def get_fields(self, fields):
+        """
+        Get several fields in one trip to the executor. Returns a dict.
+        """
+        return await self._run(_get_fields, self.parser, fields)
+
+    async def lookup_code(self, code, codesystem):
+        return await self._run(self.parser.lookup_code, code, codesystem)
+
+    async def lookup_codes(self, requests):
+        return await self._run(self.parser.lookup_codes, requests)
+
+    async def get_component(self, name=None, index=None, template_id=None):
+        return await self._run(
+            functools.partial(
+                self.parser.get_component,
+                name=name,
+                index=index,
+                template_id=template_id,
+            )
+        )
+
+    async def vitals_table(self, kind="columns"):
+        return await self._run(self.parser.vitals_table, kind)
+
+    async def close(self):
+        try:
+            await self._run(self.parser.close)
+        finally:
+            self._thread.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+def _get_field(patient, field):
+    value = getattr(patient, field)
+    if callable(value):  # methods like insurance()
+        value = value()
+    return value
+
+
+def _get_fields(patient, fields):
+    return {field: _get_field(patient, field) for field in fields}
+
+
+async def parse_async(
+    source,
+    executor=None,
+    streaming=False,
+    db_path=codeDatabase.DB_PATH,
+    sections=None,
+    fields=None,
+    skip_text=False,
+    compact=False,
+):
+    """
+    Parse `source`, a path or the document's bytes, into an `AsyncParser`.
+
+    The XML is parsed in `executor`, which can be a `ThreadPoolExecutor` or (to use
+    more than one core) a `ProcessPoolExecutor`; `None` uses the loop's default.
+    The other options are as for `Parser`.
+    """
+    loop = asyncio.get_running_loop()
+    options = dict(
+        streaming=streaming,
+        sections=sections,
+        fields=fields,
+        skip_text=skip_text,
+        compact=compact,
+    )
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+    elif streaming:
+        data = source
+    else:
+        data = await loop.run_in_executor(None, _read_bytes, source)
+
+    ccda_data = await loop.run_in_executor(executor, _parse_document, data, options)
+    del data  # don't hold the raw document while it's being set up
+
+    thread = _parser_thread()
+    try:
+        patient = await loop.run_in_executor(
+            thread,
+            functools.partial(parser.Parser.from_dict, ccda_data, db_path=db_path),
+        )
+    except BaseException:
+        thread.shutdown(wait=False)
+        raise
+    if not isinstance(source, (bytes, bytearray, memoryview)):
+        patient._filename = source
+    return AsyncParser(patient, thread)
+
+
+async def _parse_result(source, fields, executor, streaming, db_path):
+    """
+    Parse one document into a `batch.Result`, catching any exception.
+    """
+    name = None if isinstance(source, (bytes, bytearray, memoryview)) else source
+    try:
+        patient = await parse_async(
+            source,
+            executor=executor,
+            streaming=streaming,
+            db_path=db_path,
+            fields=fields,
+        )
+        async with patient:
+            data = await patient.get_fields(fields)
+    except Exception as e:
+        return batch.Result(name, None, f"{type(e).__name__}: {e}")
+
+    return batch.Result(name, data, None)
+
+
+async def parse_many_async(
+    sources,
+    fields=None,
+    concurrency=DEFAULT_CONCURRENCY,
+    executor=None,
+    streaming=False,
+    db_path=codeDatabase.DB_PATH,
+):
+    """
+    Parse every path or bytes object in `sources`, yielding a `batch.Result` for
+    each as it finishes (`path` is `None` for bytes).
+
+    At most `concurrency` documents are read or held in memory at once, and
+    `sources` is only consumed as fast as they finish. If the generator is closed
+    early (use `contextlib.aclosing` to close it as soon as the loop stops), the
+    documents still in flight are cancelled.
+    """
+    if fields is None:
+        fields = batch.DEFAULT_FIELDS
+
+    pending = set()
+    try:
+        for source in sources:
+            pending.add(
+                asyncio.ensure_future(
+                    _parse_result(source, fields, executor, streaming, db_path)
+                )
+            )
+            if len(pending) >= concurrency:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
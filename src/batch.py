@@ -0,0 +1,350 @@
+"""
+Parse many CCDAs at once across a pool of worker processes.
+
+Each worker reuses one pooled database connection (see `codeDatabase`) for every
+document it parses.
+"""
+
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import os
+import sqlite3 as sqlite
+import time
+
+import archive
+import codeCache
+import codeDatabase
+import codeSnapshot
+import codeTelemetry
+import metrics
+import parser
+
+Result = namedtuple(
+    "Result", "path data error timings telemetry", defaults=(None, None)
+)
+
+DEFAULT_FIELDS = [
+    "name",
+    "gender",
+    "dob",
+    "race_ethnicity",
+    "languages",
+    "address",
+    "phone",
+    "smoking_status",
+    "height",
+    "weight",
+    "bmi",
+]
+
+
+def _init_worker(db_path, preload, telemetry=False):
+    """
+    Set up this process, optionally preloading the small code tables into `codeCache`
+    (from the `codeSnapshot` if there's a current one) and recording `codeTelemetry`.
+
+    If the code database can't be read, nothing is preloaded: the error is left to
+    the files whose fields need codes, and the rest still parse.
+    """
+    if telemetry:
+        codeTelemetry.enable()
+    if preload:
+        try:
+            provider = codeDatabase.get_provider(db_path)
+            db_conn = provider.connection()
+            database = codeCache.database_key(db_path, provider.version())
+            if not codeSnapshot.install(db_path, db_conn, database):
+                codeCache.preload(db_conn, database)
+        except sqlite.Error:
+            pass
+
+
+def _parse_one(
+    path,
+    fields,
+    streaming,
+    db_path,
+    profile=False,
+    telemetry=False,
+    cache=None,
+    partial=False,
+):
+    """
+    Parse a single file, returning a `Result`.
+
+    Any exception is caught and stored in `error` so one bad file doesn't stop the batch.
+    With `partial`, a field that fails is left out of `data` (and named in `error`)
+    instead of failing the whole document.
+    With `profile`, `timings` has the seconds spent loading the file (`"load"`), on
+    each field, and in each of the parser's own stages (see `metrics`). With
+    `telemetry`, the `Result`'s `telemetry` has what `codeTelemetry` recorded since
+    the last file. With a `parseCache.ParseCache` as `cache`, the fields' values
+    are looked up in it by the file's contents first, and saved to it if they
+    weren't there.
+    """
+    name = path
+    if isinstance(path, archive.Member):
+        name = archive.member_path(path)
+
+    if cache is None:
+        result = _parse_fields(path, name, fields, streaming, db_path, profile, partial)
+    else:
+        result = _parse_cached(
+            path, name, fields, streaming, db_path, profile, cache, partial
+        )
+    if telemetry and codeTelemetry.recorder:
+        result = result._replace(telemetry=codeTelemetry.recorder.drain())
+    return result
+
+
+def _open(source, streaming, db_path, fields, metrics):
+    """
+    Start a `Parser` for a file, an `archive.Member` or a document's bytes.
+
+    Zip members and streamed tar members are parsed as they're decompressed, so
+    `streaming` only applies to files and bytes.
+    """
+    if isinstance(source, archive.Member):
+        if not isinstance(source.data, bytes):
+            with archive.open_member(source) as member:
+                return parser.Parser.from_file(
+                    member, db_path=db_path, fields=fields, metrics=metrics
+                )
+        source = source.data
+
+    if isinstance(source, bytes):
+        return parser.Parser.from_bytes(
+            source,
+            streaming=streaming,
+            db_path=db_path,
+            fields=fields,
+            metrics=metrics,
+        )
+    return parser.Parser(
+        source, streaming=streaming, db_path=db_path, fields=fields, metrics=metrics
+    )
+
+
+def _read(source):
+    """
+    Read the bytes of a file or an `archive.Member`.
+    """
+    if isinstance(source, archive.Member):
+        if isinstance(source.data, bytes):
+            return source.data
+        with archive.open_member(source) as member:
+            return member.read()
+    with open(source, "rb") as f:
+        return f.read()
+
+
+def _parse_cached(source, path, fields, streaming, db_path, profile, cache, partial):
+    start = time.perf_counter()
+    try:
+        data = _read(source)
+        key = cache.record_key(data, fields, db_path)
+        record = cache.get(key)
+    except Exception as e:
+        return Result(path, None, f"{type(e).__name__}: {e}")
+
+    if record is not None:
+        timings = {"cache": time.perf_counter() - start} if profile else None
+        return Result(path, record, None, timings)
+
+    result = _parse_fields(data, path, fields, streaming, db_path, profile, partial)
+    if result.error is None:  # partial results aren't cached
+        cache.put(key, result.data)
+    return result
+
+
+def _get_field(patient, field):
+    value = getattr(patient, field)
+    if callable(value):  # methods like insurance()
+        value = value()
+    return value
+
+
+def _parse_fields(source, path, fields, streaming, db_path, profile, partial=False):
+    timings = {} if profile else None
+    stages = metrics.Metrics() if profile else None
+    errors = []
+    try:
+        start = time.perf_counter()
+        with _open(source, streaming, db_path, fields, stages) as patient:
+            if profile:
+                timings["load"] = time.perf_counter() - start
+            data = {}
+            for field in fields:
+                start = time.perf_counter()
+                if not partial:
+                    data[field] = _get_field(patient, field)
+                else:
+                    try:
+                        data[field] = _get_field(patient, field)
+                    except Exception as e:
+                        errors.append(f"{field}: {type(e).__name__}: {e}")
+                if profile:
+                    timings[field] = time.perf_counter() - start
+    except Exception as e:
+        return Result(path, None, f"{type(e).__name__}: {e}", timings)
+    finally:
+        if profile:
+            timings.update(stages.totals())
+
+    return Result(path, data, "; ".join(errors) or None, timings)
+
+
+def find_ccdas(paths, read_members=True):
+    """
+    Expand directories in `paths` into the XML files inside them, and zip and tar
+    archives into an `archive.Member` for each XML file inside them.
+
+    Without `read_members`, tar members are only readable until the next one is
+    yielded (see `archive.members`).
+    """
+    for path in paths:
+        if archive.is_archive(path):
+            yield from archive.members(path, read=read_members)
+        elif os.path.isdir(path):
+            for entry in sorted(os.scandir(path), key=lambda e: e.name):
+                if entry.is_file() and entry.name.lower().endswith(".xml"):
+                    yield entry.path
+        else:
+            yield path
+
+
+def parse_many(
+    paths,
+    fields=None,
+    workers=None,
+    ordered=True,
+    streaming=False,
+    preload=True,
+    db_path=codeDatabase.DB_PATH,
+    profile=False,
+    telemetry=None,
+    cache=None,
+    partial=False,
+):
+    """
+    Parse every file in `paths`. Directories are searched for `.xml` files, and zip
+    and tar archives are read without extracting them (see `archive`); a member's
+    `Result.path` is `archive!member`.
+
+    Yields a `Result` per file as soon as it is ready: in input order if `ordered`,
+    otherwise in the order they finish. `fields` are the `Parser` properties or
+    methods to pull out, defaulting to `DEFAULT_FIELDS`; only the sections they
+    need are parsed.
+
+    `workers` is the number of processes to use, defaulting to the CPU count.
+    With `workers=1` everything runs in this process. `preload` loads the small code
+    tables into memory in each worker (see `codeCache.preload`), if the code
+    database can be opened: fields that need no codes (like `name` and `dob`) parse
+    without one, as with a single `Parser`. `profile` fills in
+    each `Result`'s `timings`. Code database telemetry from every worker is added
+    to `telemetry`, a `codeTelemetry.Telemetry`, as the results come in. With a
+    `parseCache.ParseCache` as `cache`, documents whose fields have already been
+    parsed (with the same parser and code database) are read from it instead.
+
+    A file that can't be parsed gets a `Result` with its `error` and no `data`.
+    With `partial`, so does a field that fails, but only that field is left out of
+    `data`: `error` names each failed field, and the rest are still there.
+    """
+    if fields is None:
+        fields = DEFAULT_FIELDS
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # in this process each tar member is parsed before the next one is read
+    paths = find_ccdas(paths, read_members=workers != 1)
+    results = _parse_paths(
+        paths,
+        fields,
+        workers,
+        ordered,
+        streaming,
+        preload,
+        db_path,
+        profile,
+        telemetry is not None,
+        cache,
+        partial,
+    )
+
+    for result in results:
+        if result.telemetry is not None:
+            if telemetry is not None:
+                telemetry.merge(result.telemetry)
+            result = result._replace(telemetry=None)
+        yield result
+
+
+def _parse_paths(
+    paths,
+    fields,
+    workers,
+    ordered,
+    streaming,
+    preload,
+    db_path,
+    profile,
+    telemetry,
+    cache,
+    partial,
+):
+    if workers == 1:
+        recorder = codeTelemetry.recorder
+        _init_worker(db_path, preload, telemetry)
+        try:
+            for path in paths:
+                yield _parse_one(
+                    path, fields, streaming, db_path, profile, telemetry, cache, partial
+                )
+        finally:
+            if telemetry:  # put back whatever was recording before
+                if recorder is None:
+                    codeTelemetry.disable()
+                else:
+                    codeTelemetry.enable(recorder)
+        return
+
+    max_pending = workers * 4  # don't queue the whole batch at once
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(db_path, preload, telemetry),
+    ) as pool:
+        pending = deque() if ordered else set()
+
+        for path in paths:
+            future = pool.submit(
+                _parse_one,
+                path,
+                fields,
+                streaming,
+                db_path,
+                profile,
+                telemetry,
+                cache,
+                partial,
+            )
+            if ordered:
+                pending.append(future)
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            else:
+                pending.add(future)
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+
+        if ordered:
+            while pending:
+                yield pending.popleft().result()
+        else:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
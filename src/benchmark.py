@@ -0,0 +1,592 @@
+"""
+Benchmarks for the parser's hot paths, run on generated CCDAs.
+
+Generates synthetic documents of a given size and a small code database to go
+with them, then times loading, each patient property, `get_latest_vital`,
+`insurance()` and code lookups. Reports throughput, p50/p99 latency and peak RSS.
+
+Also times `import parser` in a fresh interpreter and fails if it's over
+`IMPORT_BUDGET_MS` or pulls in one of the `LAZY_MODULES`.
+
+Usage::
+
+    python benchmark.py --vitals 200 --results 500 --json before.json
+    python benchmark.py --vitals 200 --results 500 --compare before.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3 as sqlite
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import buildCodeDatabase
+import codeCache
+import codeData
+import codeDatabase
+import parser
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_BUDGET_MS = 150
+
+# slow imports that `import parser` must leave until they're needed
+LAZY_MODULES = ["pint", "iso639", "numpy", "pandas", "guizero"]
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import parser
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "modules": sorted(sys.modules)}))
+"""
+
+PROPERTIES = [
+    "name",
+    "gender",
+    "dob",
+    "race_ethnicity",
+    "languages",
+    "address",
+    "phone",
+    "smoking_status",
+    "height",
+    "weight",
+    "bmi",
+]
+
+# result observations to pick from: (code, name, unit, low, high)
+RESULT_TESTS = [
+    ("2345-7", "Glucose", "mg/dL", 70, 140),
+    ("2160-0", "Creatinine", "mg/dL", 0.6, 1.3),
+    ("718-7", "Hemoglobin", "g/dL", 11, 17),
+    ("2951-2", "Sodium", "mmol/L", 134, 146),
+    ("6690-2", "Leukocytes", "10*3/uL", 4, 11),
+]
+
+# extra sections to pad documents with: (templateId, code, title)
+FILLER_SECTIONS = [
+    ("2.16.840.1.113883.10.20.22.2.5.1", "11450-4", "Problems"),
+    ("2.16.840.1.113883.10.20.22.2.1.1", "10160-0", "Medications"),
+    ("2.16.840.1.113883.10.20.22.2.6.1", "48765-2", "Allergies"),
+    ("2.16.840.1.113883.10.20.22.2.7.1", "47519-4", "Procedures"),
+    ("2.16.840.1.113883.10.20.22.2.2.1", "11369-6", "Immunizations"),
+]
+
+HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<ClinicalDocument xmlns="urn:hl7-org:v3" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:sdtc="urn:hl7-org:sdtc">
+<realmCode code="US"/>
+<typeId root="2.16.840.1.113883.1.3" extension="POCD_HD000040"/>
+<templateId root="2.16.840.1.113883.10.20.22.1.2"/>
+<id root="2.16.840.1.113883.19.5" extension="{n}"/>
+<code code="34133-9" codeSystem="2.16.840.1.113883.6.1" displayName="Summarization of Episode Note"/>
+<title>Synthetic CCD {n}</title>
+<effectiveTime value="20240101120000-0500"/>
+<recordTarget>
+<patientRole>
+<id root="2.16.840.1.113883.19.5" extension="{n}"/>
+<addr use="HP"><streetAddressLine>{n} Main Street</streetAddressLine><city>Portland</city><state>OR</state><postalCode>97005</postalCode><country>US</country></addr>
+<telecom value="tel:+1(555)555-{phone:04d}" use="HP"/>
+<patient>
+<name use="L"><given>Test</given><family>Patient{n}</family></name>
+<administrativeGenderCode code="F" codeSystem="2.16.840.1.113883.5.1" displayName="Female"/>
+<birthTime value="19750501"/>
+<raceCode code="2106-3" codeSystem="2.16.840.1.113883.6.238" displayName="White"/>
+<ethnicGroupCode code="2186-5" codeSystem="2.16.840.1.113883.6.238" displayName="Not Hispanic or Latino"/>
+<languageCommunication><languageCode code="en"/><preferenceInd value="true"/></languageCommunication>
+</patient>
+</patientRole>
+</recordTarget>
+<component>
+<structuredBody>
+"""
+
+FOOTER = """</structuredBody>
+</component>
+</ClinicalDocument>
+"""
+
+SECTION = """<component>
+<section>
+<templateId root="{template_id}"/>
+<code code="{code}" codeSystem="2.16.840.1.113883.6.1"/>
+<title>{title}</title>
+<text><table><tbody>{rows}</tbody></table></text>
+{entries}</section>
+</component>
+"""
+
+OBSERVATION = """<component><observation classCode="OBS" moodCode="EVN"><templateId root="{template_id}"/><code code="{code}" codeSystem="2.16.840.1.113883.6.1" displayName="{name}"/><statusCode code="completed"/><effectiveTime value="{time}"/><value xsi:type="PQ" value="{value}" unit="{unit}"/></observation></component>"""
+
+ORGANIZER = """<entry typeCode="DRIV"><organizer classCode="CLUSTER" moodCode="EVN"><templateId root="{template_id}"/><code code="46680005" codeSystem="2.16.840.1.113883.6.96"/><statusCode code="completed"/><effectiveTime value="{time}"/>{observations}</organizer></entry>
+"""
+
+ENCOUNTER = """<entry typeCode="DRIV"><encounter classCode="ENC" moodCode="EVN"><templateId root="2.16.840.1.113883.10.20.22.4.49"/><code code="99213" codeSystem="2.16.840.1.113883.6.12" displayName="Office outpatient visit"/><effectiveTime value="{time}"/></encounter></entry>
+"""
+
+SMOKING = """<entry typeCode="DRIV"><observation classCode="OBS" moodCode="EVN"><templateId root="2.16.840.1.113883.10.20.22.4.78"/><code code="72166-2" codeSystem="2.16.840.1.113883.6.1"/><statusCode code="completed"/><effectiveTime><low value="20120910"/></effectiveTime><value xsi:type="CD" code="8517006" codeSystem="2.16.840.1.113883.6.96"/></observation></entry>
+"""
+
+PAYER = """<entry typeCode="DRIV"><act classCode="ACT" moodCode="EVN"><templateId root="2.16.840.1.113883.10.20.22.4.60"/><code code="48768-6" codeSystem="2.16.840.1.113883.6.1"/><statusCode code="completed"/>
+<entryRelationship typeCode="COMP"><act classCode="ACT" moodCode="EVN"><templateId root="2.16.840.1.113883.10.20.22.4.61"/><code code="SELF" codeSystem="2.16.840.1.113883.5.111"/><statusCode code="completed"/>
+<performer typeCode="PRF"><templateId root="2.16.840.1.113883.10.20.22.4.87"/><assignedEntity><id root="2.16.840.1.113883.19"/><representedOrganization><name>Good Health Insurance</name><telecom value="tel:+1(555)555-1515" use="WP"/><addr use="WP"><streetAddressLine>9009 Health Drive</streetAddressLine><city>Portland</city><state>OR</state><postalCode>99123</postalCode><country>US</country></addr></representedOrganization></assignedEntity></performer>
+<performer typeCode="PRF"><templateId root="2.16.840.1.113883.10.20.22.4.88"/><assignedEntity><id root="2.16.840.1.113883.19"/><addr use="HP"><streetAddressLine>{n} Main Street</streetAddressLine><city>Portland</city><state>OR</state><postalCode>97005</postalCode><country>US</country></addr><telecom value="tel:+1(555)555-1000" use="HP"/><assignedPerson><name><given>Test</given><family>Patient{n}</family></name></assignedPerson></assignedEntity></performer>
+<participant typeCode="COV"><templateId root="2.16.840.1.113883.10.20.22.4.89"/><participantRole><id root="2.16.840.1.113883.19" extension="{n}"/></participantRole></participant>
+<participant typeCode="HLD"><templateId root="2.16.840.1.113883.10.20.22.4.90"/><participantRole><id root="2.16.840.1.113883.19" extension="{n}"/></participantRole></participant>
+</act></entryRelationship></act></entry>
+"""
+
+
+def _timestamp(rng):
+    return f"{rng.randint(2000, 2023)}{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}"
+
+
+def _rows(count):
+    return "".join(
+        f"<tr><td>Row {i}</td><td>Narrative text {i}</td></tr>" for i in range(count)
+    )
+
+
+def _section(template_id, code, title, entries, rows):
+    return SECTION.format(
+        template_id=template_id,
+        code=code,
+        title=title,
+        rows=_rows(rows),
+        entries="".join(entries),
+    )
+
+
+def generate_ccda(n=0, sections=5, vitals=10, results=20, encounters=10, seed=None):
+    """
+    Generate a synthetic C-CDA document as a string.
+
+    Always has Vital Signs (`vitals` organizers of height, weight and BMI),
+    Results (`results` organizers of five tests), Encounters, Social History and
+    Payers sections, plus `sections` filler sections with narrative and entries.
+    """
+    rng = random.Random(n if seed is None else seed)
+    parts = [HEADER.format(n=n, phone=n % 10000)]
+
+    vital_organizers = []
+    for _ in range(vitals):
+        when = _timestamp(rng)
+        height = round(rng.uniform(150, 195), 1)
+        weight = round(rng.uniform(50, 120), 1)
+        observations = [
+            ("8302-2", "Body height", height, "cm"),
+            ("29463-7", "Body weight", weight, "kg"),
+            (
+                "39156-5",
+                "Body mass index",
+                round(weight / (height / 100) ** 2),
+                "kg/m2",
+            ),
+        ]
+        vital_organizers.append(
+            ORGANIZER.format(
+                template_id="2.16.840.1.113883.10.20.22.4.26",
+                time=when,
+                observations="".join(
+                    OBSERVATION.format(
+                        template_id="2.16.840.1.113883.10.20.22.4.27",
+                        code=code,
+                        name=name,
+                        time=when,
+                        value=value,
+                        unit=unit,
+                    )
+                    for code, name, value, unit in observations
+                ),
+            )
+        )
+    parts.append(
+        _section(
+            "2.16.840.1.113883.10.20.22.2.4.1",
+            "8716-3",
+            "Vital Signs",
+            vital_organizers,
+            vitals,
+        )
+    )
+
+    result_organizers = []
+    for _ in range(results):
+        when = _timestamp(rng)
+        result_organizers.append(
+            ORGANIZER.format(
+                template_id="2.16.840.1.113883.10.20.22.4.1",
+                time=when,
+                observations="".join(
+                    OBSERVATION.format(
+                        template_id="2.16.840.1.113883.10.20.22.4.2",
+                        code=code,
+                        name=name,
+                        time=when,
+                        value=round(rng.uniform(low, high), 1),
+                        unit=unit,
+                    )
+                    for code, name, unit, low, high in RESULT_TESTS
+                ),
+            )
+        )
+    parts.append(
+        _section(
+            "2.16.840.1.113883.10.20.22.2.3.1",
+            "30954-2",
+            "Results",
+            result_organizers,
+            results,
+        )
+    )
+
+    parts.append(
+        _section(
+            "2.16.840.1.113883.10.20.22.2.22.1",
+            "46240-8",
+            "Encounters",
+            [ENCOUNTER.format(time=_timestamp(rng)) for _ in range(encounters)],
+            encounters,
+        )
+    )
+    parts.append(
+        _section(
+            "2.16.840.1.113883.10.20.22.2.17", "29762-2", "Social History", [SMOKING], 1
+        )
+    )
+    parts.append(
+        _section(
+            "2.16.840.1.113883.10.20.22.2.18",
+            "48768-6",
+            "Payers",
+            [PAYER.format(n=n)],
+            1,
+        )
+    )
+
+    for i in range(sections):
+        template_id, code, title = FILLER_SECTIONS[i % len(FILLER_SECTIONS)]
+        entries = [ENCOUNTER.format(time=_timestamp(rng)) for _ in range(5)]
+        parts.append(_section(template_id, code, title, entries, 20))
+
+    parts.append(FOOTER)
+    return "".join(parts)
+
+
+def build_benchmark_database(db_path):
+    """
+    Build a small code database with the codes used by `generate_ccda`.
+    """
+    tables = {
+        "loinc": [
+            ("8716-3", "Vital signs"),
+            ("29762-2", "Social history"),
+            ("48768-6", "Payment sources"),
+            ("30954-2", "Results"),
+            ("46240-8", "History of encounters"),
+            ("8302-2", "Body height"),
+            ("29463-7", "Body weight"),
+            ("39156-5", "Body mass index"),
+            ("72166-2", "Tobacco smoking status"),
+        ]
+        + [(code, name) for code, name, *_ in RESULT_TESTS],
+        "snomed": [
+            (code, name) for code, name in codeData.snomed_codes.items() if code != name
+        ],
+        "hl7_address_use": list(codeData.hl7_phone_codes.items()),
+        "administrative_gender": [("F", "Female"), ("M", "Male")],
+        "cdc_rec": [("2106-3", "White"), ("2186-5", "Not Hispanic or Latino")],
+    }
+
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    db = sqlite.connect(db_path, isolation_level=None)
+    cur = db.cursor()
+    cur.execute("BEGIN")
+    for table, rows in tables.items():
+        buildCodeDatabase.load_code_table(cur, table, rows)
+    buildCodeDatabase.create_metadata(cur, {table: "benchmark" for table in tables})
+    cur.execute("COMMIT")
+    cur.execute("ANALYZE")
+    db.close()
+
+
+def peak_rss_mb():
+    """
+    Get the peak resident set size of this process in MB, or `None` on Windows.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":  # bytes, not KB
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def _percentile(times, fraction):
+    ordered = sorted(times)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(name, func, repeat, setup=None, nbytes=None):
+    """
+    Time `func` `repeat` times and summarize the results as a dict.
+
+    If `setup` is given, it's called (untimed) before each run and its result is
+    passed to `func`.
+    """
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        start = time.perf_counter()
+        if setup is not None:
+            func(arg)
+        else:
+            func()
+        times.append(time.perf_counter() - start)
+
+    total = sum(times)
+    result = {
+        "name": name,
+        "runs": repeat,
+        "p50_ms": _percentile(times, 0.50) * 1000,
+        "p99_ms": _percentile(times, 0.99) * 1000,
+        "ops_per_s": repeat / total if total else float("inf"),
+    }
+    if nbytes is not None:
+        result["mb_per_s"] = nbytes * repeat / total / (1024 * 1024) if total else None
+    return result
+
+
+def measure_import(repeat=5):
+    """
+    Time `import parser` in `repeat` fresh interpreters.
+
+    Returns the fastest time in milliseconds and which `LAZY_MODULES` got imported.
+    """
+    times = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT],
+            cwd=SRC,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        result = json.loads(output)
+        times.append(result["seconds"] * 1000)
+
+    loaded = [module for module in LAZY_MODULES if module in result["modules"]]
+    return min(times), loaded
+
+
+def check_import(budget_ms=IMPORT_BUDGET_MS):
+    """
+    Check `import parser` is under `budget_ms` and doesn't load any `LAZY_MODULES`.
+
+    Returns a list of problems (empty if it passed).
+    """
+    import_ms, loaded = measure_import()
+    print(f"import parser: {import_ms:.1f} ms (budget {budget_ms} ms)")
+
+    problems = []
+    if import_ms > budget_ms:
+        problems.append(f"import parser took {import_ms:.1f} ms")
+    if loaded:
+        problems.append(f"import parser loaded {', '.join(loaded)}")
+    for problem in problems:
+        print(f"IMPORT {problem}")
+    return problems
+
+
+def run(args):
+    """
+    Generate the documents and database, run every benchmark and return the results.
+    """
+    with tempfile.TemporaryDirectory(prefix="ccda-bench-") as workdir:
+        return _run(args, workdir)
+
+
+def _run(args, workdir):
+    db_path = os.path.join(workdir, "codeDatabase.db")
+    build_benchmark_database(db_path)
+
+    filename = os.path.join(workdir, "synthetic.xml")
+    with open(filename, "w", encoding="utf8") as f:
+        f.write(
+            generate_ccda(
+                sections=args.sections,
+                vitals=args.vitals,
+                results=args.results,
+                encounters=args.encounters,
+            )
+        )
+    size = os.path.getsize(filename)
+
+    def new_parser(streaming=False, **options):
+        return parser.Parser(filename, streaming=streaming, db_path=db_path, **options)
+
+    repeat = args.repeat
+    results = [
+        measure("load", new_parser, repeat, nbytes=size),
+        measure("load (streaming)", lambda: new_parser(True), repeat, nbytes=size),
+        measure(
+            "load (vital signs only)",
+            lambda: new_parser(sections=["vital signs"]),
+            repeat,
+            nbytes=size,
+        ),
+        measure(
+            "load (header only)",
+            lambda: new_parser(fields=["demographics"]),
+            repeat,
+            nbytes=size,
+        ),
+    ]
+
+    for prop in PROPERTIES:
+        results.append(
+            measure(f"property {prop}", lambda p: getattr(p, prop), repeat, new_parser)
+        )
+
+    results.append(
+        measure("demographics()", lambda p: p.demographics(), repeat, new_parser)
+    )
+    for vital in ["Height", "Weight", "BMI"]:
+        results.append(
+            measure(
+                f"get_latest_vital {vital}",
+                lambda p: p.get_latest_vital(vital),
+                repeat,
+                new_parser,
+            )
+        )
+    results.append(
+        measure("vitals_table()", lambda p: p.vitals_table(), repeat, new_parser)
+    )
+    results.append(measure("insurance()", lambda p: p.insurance(), repeat, new_parser))
+
+    patient = new_parser()
+
+    def cold_cache():
+        codeCache.clear()
+        return patient
+
+    results.append(
+        measure(
+            "lookup_code (cold)",
+            lambda p: p.lookup_code("8517006", "snomed"),
+            repeat,
+            cold_cache,
+        )
+    )
+    results.append(
+        measure(
+            "lookup_code (cached)",
+            lambda: patient.lookup_code("8517006", "snomed"),
+            repeat,
+        )
+    )
+    results.append(
+        measure(
+            "lookup_code reverse (cold)",
+            lambda p: p.lookup_code("Vital signs", "reverse_loinc"),
+            repeat,
+            cold_cache,
+        )
+    )
+
+    patient.close()
+    codeDatabase.close_all()
+
+    return {
+        "document_bytes": size,
+        "peak_rss_mb": peak_rss_mb(),
+        "benchmarks": results,
+    }
+
+
+def print_report(report):
+    print(f"document size: {report['document_bytes'] / 1024:.0f} KB")
+    print(f"{'benchmark':<28} {'p50 ms':>10} {'p99 ms':>10} {'ops/s':>10}")
+    for result in report["benchmarks"]:
+        print(
+            f"{result['name']:<28} {result['p50_ms']:>10.3f} "
+            f"{result['p99_ms']:>10.3f} {result['ops_per_s']:>10.1f}"
+        )
+    if report["peak_rss_mb"] is not None:
+        print(f"peak RSS: {report['peak_rss_mb']:.1f} MB")
+
+
+def compare(report, baseline, threshold):
+    """
+    Compare p50 latencies against a saved report.
+
+    Returns the names of benchmarks that got slower by more than `threshold` times.
+    """
+    before = {result["name"]: result for result in baseline["benchmarks"]}
+    regressions = []
+    for result in report["benchmarks"]:
+        old = before.get(result["name"])
+        if old is not None and result["p50_ms"] > old["p50_ms"] * threshold:
+            regressions.append(result["name"])
+            print(
+                f"REGRESSION {result['name']}: "
+                f"{old['p50_ms']:.3f} ms -> {result['p50_ms']:.3f} ms"
+            )
+    return regressions
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--sections", type=int, default=5, help="filler sections")
+    arg_parser.add_argument("--vitals", type=int, default=10, help="vital organizers")
+    arg_parser.add_argument("--results", type=int, default=20, help="result organizers")
+    arg_parser.add_argument("--encounters", type=int, default=10, help="encounters")
+    arg_parser.add_argument("--repeat", type=int, default=20, help="runs per benchmark")
+    arg_parser.add_argument("--json", help="save the results to this file")
+    arg_parser.add_argument("--compare", help="compare against saved results")
+    arg_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="slowdown factor that counts as a regression",
+    )
+    arg_parser.add_argument(
+        "--import-budget",
+        type=float,
+        default=IMPORT_BUDGET_MS,
+        help="maximum milliseconds for import parser",
+    )
+    args = arg_parser.parse_args(argv)
+
+    import_problems = check_import(args.import_budget)
+
+    report = run(args)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf8") as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+    if import_problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
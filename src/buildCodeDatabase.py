@@ -0,0 +1,229 @@
+"""
+Build codeDatabase.db from the raw code files.
+
+Replaces loadLOINCCodes.py. Every code table gets a primary key on `code` and an
+index on `description` (both case-insensitive), and the whole build happens in
+one transaction in a temporary file that is swapped in when it's done. A new
+`codeSnapshot` of the most used codes is written next to it.
+
+Usage::
+
+    python buildCodeDatabase.py --loinc "Raw Data/Loinc.csv" --table snomed=snomed.csv
+    python buildCodeDatabase.py --table cdc_rec="Raw Data/CDC_REC.xlsx"
+"""
+
+import argparse
+import csv
+import datetime
+import os
+import sqlite3 as sqlite
+import time
+
+import codeDatabase
+import codeSnapshot
+
+RAW_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Raw Data")
+
+# code tables built from the two-column CSVs in Raw Data
+DEFAULT_TABLES = {
+    "hl7_address_use": os.path.join(RAW_DATA, "hl7 phone codes.csv"),
+    "hl7_marital_status": os.path.join(RAW_DATA, "hl7_marriage_codes.csv"),
+}
+
+# codesystem OIDs of the tables we know about
+CODESYSTEMS = {
+    "loinc": "2.16.840.1.113883.6.1",
+    "snomed": "2.16.840.1.113883.6.96",
+    "hl7_address_use": "2.16.840.1.113883.5.1119",
+    "hl7_marital_status": "2.16.840.1.113883.5.2",
+    "administrative_gender": "2.16.840.1.113883.5.1",
+    "cdc_rec": "2.16.840.1.113883.6.238",
+}
+
+BUILD_PRAGMAS = [
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -262144",  # 256MB
+]
+
+
+def read_loinc(path):
+    """
+    Read `(code, description)` rows from a LOINC table CSV, skipping the header.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.reader(f):
+            if row[0] == "LOINC_NUM":  # header
+                continue
+            yield row[0], row[1]
+
+
+def read_codes(path):
+    """
+    Read `(code, description)` rows from a two-column CSV.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.reader(f):
+            if len(row) >= 2:
+                yield row[0], row[1]
+
+
+def read_cdc_rec(path):
+    """
+    Read `(code, description)` rows from the CDC race and ethnicity workbook
+    (needs openpyxl).
+    """
+    import loadCDC_REC
+
+    return loadCDC_REC.read_cdc_rec(path)
+
+
+# readers for tables that aren't two-column CSVs
+READERS = {"loinc": read_loinc, "cdc_rec": read_cdc_rec}
+
+
+def create_code_table(cur, table):
+    """
+    Create an empty code table. The description index is added by `index_code_table`.
+    """
+    cur.execute(
+        f"""CREATE TABLE {table} (
+        code TEXT COLLATE NOCASE PRIMARY KEY,
+        description TEXT COLLATE NOCASE
+        ) WITHOUT ROWID;"""
+    )
+
+
+def index_code_table(cur, table):
+    """
+    Index a code table's descriptions (for reverse lookups).
+    """
+    cur.execute(f"CREATE INDEX {table}_description ON {table} (description);")
+
+
+def load_code_table(cur, table, rows):
+    """
+    Create, fill and index a code table. Returns the number of rows inserted.
+    """
+    create_code_table(cur, table)
+    cur.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?)", rows)
+    count = cur.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+    index_code_table(cur, table)
+    return count
+
+
+def create_metadata_tables(cur):
+    """
+    Create the `codesystems` and `metadata` tables if they don't exist.
+    """
+    cur.execute(
+        """CREATE TABLE IF NOT EXISTS codesystems (
+        codesystem_id TEXT PRIMARY KEY,
+        codesystem_name TEXT NOT NULL
+        ) WITHOUT ROWID;"""
+    )
+    cur.execute(
+        """CREATE TABLE IF NOT EXISTS metadata (
+        key TEXT PRIMARY KEY,
+        value TEXT
+        ) WITHOUT ROWID;"""
+    )
+
+
+def create_metadata(cur, sources):
+    """
+    Create and fill the `codesystems` and `metadata` tables.
+    """
+    create_metadata_tables(cur)
+    cur.executemany(
+        "INSERT INTO codesystems VALUES (?, ?)",
+        [(CODESYSTEMS[table], table) for table in sources if table in CODESYSTEMS],
+    )
+
+    metadata = {
+        "schema_version": str(codeDatabase.SCHEMA_VERSION),
+        "built_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    for table, path in sources.items():
+        metadata[f"source:{table}"] = os.path.basename(path)
+    cur.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+
+
+def build(db_path, sources):
+    """
+    Build the database at `db_path` from `sources`, a dict of table name to CSV path.
+
+    Tables in `READERS` (`loinc`, and `cdc_rec` from the CDC workbook) are read
+    with their own reader, everything else with `read_codes`.
+    """
+    tmp_path = db_path + ".building"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    db = sqlite.connect(tmp_path, isolation_level=None)
+    cur = db.cursor()
+    for pragma in BUILD_PRAGMAS:
+        cur.execute(pragma)
+
+    cur.execute("BEGIN")
+    try:
+        for table, path in sources.items():
+            reader = READERS.get(table, read_codes)
+            start = time.perf_counter()
+            count = load_code_table(cur, table, reader(path))
+            print(f"{table}: {count} rows in {time.perf_counter() - start:.1f}s")
+
+        create_metadata(cur, sources)
+        cur.execute("COMMIT")
+    except BaseException:
+        cur.execute("ROLLBACK")
+        db.close()
+        os.remove(tmp_path)
+        raise
+
+    cur.execute("ANALYZE")
+    db.close()
+
+    os.replace(tmp_path, db_path)
+
+    count = codeSnapshot.write(db_path)
+    print(f"snapshot: {count} codes")
+
+
+def parse_table_arg(arg):
+    """
+    Parse a `name=path` table argument.
+    """
+    table, sep, path = arg.partition("=")
+    if not sep or not table.isidentifier():
+        raise argparse.ArgumentTypeError(f"expected NAME=CSV, got {arg!r}")
+    return table, path
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--db", default=codeDatabase.DB_PATH, help="output file")
+    arg_parser.add_argument("--loinc", help="LOINC table CSV (Loinc.csv)")
+    arg_parser.add_argument(
+        "--table",
+        action="append",
+        default=[],
+        type=parse_table_arg,
+        metavar="NAME=CSV",
+        help="extra two-column code table (can be repeated)",
+    )
+    args = arg_parser.parse_args(argv)
+
+    sources = {}
+    if args.loinc:
+        sources["loinc"] = args.loinc
+    sources.update(DEFAULT_TABLES)
+    sources.update(args.table)
+
+    build(args.db, sources)
+
+
+if __name__ == "__main__":
+    main()
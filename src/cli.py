@@ -0,0 +1,186 @@
+"""
+Command line interface: `ccda-parse`.
+
+Replaces parseCCDA.py. Parses CCDAs (files, directories, zip/tar archives, globs,
+or paths read from stdin with `-`) and writes one JSON object per document (JSON
+Lines)::
+
+    python cli.py CCDAs/*.xml --fields name,dob,height --jobs 4 > patients.jsonl
+    find CCDAs -name "*.xml" | python cli.py - --profile
+
+Each line has `path`, `error` (null unless the document failed) and the requested
+fields. The parser is only imported once the arguments are checked, so `--help`
+and argument errors return immediately.
+"""
+
+import argparse
+import glob
+import json
+import math
+import sys
+import time
+
+DEFAULT_DB = "codeDatabase.db"  # codeDatabase.DB_PATH, without importing it
+
+
+def expand_paths(args, stdin=sys.stdin):
+    """
+    Expand globs in `args` (for shells that don't) and read paths from `stdin`
+    for `-`, one per line.
+    """
+    for arg in args:
+        if arg == "-":
+            for line in stdin:
+                line = line.strip()
+                if line:
+                    yield line
+        elif any(char in arg for char in "*?["):
+            yield from sorted(glob.glob(arg, recursive=True))
+        else:
+            yield arg
+
+
+def to_json(value):
+    """
+    Make a field value JSON serializable: namedtuples become objects, arrays become
+    lists and NaN becomes null.
+    """
+    if hasattr(value, "_asdict"):
+        value = value._asdict()
+    elif hasattr(value, "tolist"):  # NumPy arrays
+        value = value.tolist()
+
+    if isinstance(value, dict):
+        return {str(key): to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def print_profile(results, startup, elapsed, out=sys.stderr):
+    """
+    Print import time, throughput and the total and mean time per stage.
+    """
+    errors = sum(result.error is not None for result in results)
+    totals = {}
+    for result in results:
+        for stage, seconds in (result.timings or {}).items():
+            totals.setdefault(stage, []).append(seconds)
+
+    print(f"startup: {startup * 1000:.1f}ms", file=out)
+    print(
+        f"documents: {len(results)} ({errors} failed) in {elapsed:.3f}s"
+        f" ({len(results) / elapsed if elapsed else 0:.1f}/s)",
+        file=out,
+    )
+    for stage, seconds in totals.items():
+        print(
+            f"{stage}: {sum(seconds):.3f}s total,"
+            f" {sum(seconds) / len(seconds) * 1000:.2f}ms mean",
+            file=out,
+        )
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(
+        prog="ccda-parse", description=__doc__.splitlines()[1]
+    )
+    arg_parser.add_argument(
+        "paths",
+        nargs="*",
+        default=["-"],
+        help="CCDA files, directories, archives, globs or -",
+    )
+    arg_parser.add_argument(
+        "-f",
+        "--fields",
+        help="comma separated fields, from parser.FIELDS (default: batch.DEFAULT_FIELDS)",
+    )
+    arg_parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="worker processes (default 1)"
+    )
+    arg_parser.add_argument(
+        "-o", "--output", type=argparse.FileType("w"), default=sys.stdout
+    )
+    arg_parser.add_argument(
+        "--unordered", action="store_true", help="write documents as they finish"
+    )
+    arg_parser.add_argument(
+        "--streaming", action="store_true", help="load documents with loader"
+    )
+    arg_parser.add_argument("--db", default=DEFAULT_DB, help="code database")
+    arg_parser.add_argument(
+        "--profile", action="store_true", help="print timings to stderr"
+    )
+    arg_parser.add_argument(
+        "--telemetry",
+        type=argparse.FileType("w"),
+        metavar="FILE",
+        help="write a JSON report of missing codes and slow queries",
+    )
+    arg_parser.add_argument(
+        "--cache",
+        metavar="PATH",
+        help="reuse fields parsed in earlier runs, from a parseCache file",
+    )
+    args = arg_parser.parse_args(argv)
+
+    start = time.perf_counter()
+    import batch
+    import codeDatabase
+    import codeTelemetry
+    import parseCache
+    import parser
+
+    startup = time.perf_counter() - start
+
+    fields = batch.DEFAULT_FIELDS
+    if args.fields:
+        fields = [field.strip() for field in args.fields.split(",") if field.strip()]
+        unknown = [field for field in fields if field not in parser.FIELDS]
+        if unknown:
+            arg_parser.error(
+                f"unknown fields: {', '.join(unknown)} "
+                f"(choose from {', '.join(sorted(parser.FIELDS))})"
+            )
+
+    telemetry = codeTelemetry.Telemetry() if args.telemetry else None
+    cache = parseCache.ParseCache(args.cache) if args.cache else None
+
+    start = time.perf_counter()
+    results = []
+    for result in batch.parse_many(
+        expand_paths(args.paths),
+        fields=fields,
+        workers=args.jobs,
+        ordered=not args.unordered,
+        streaming=args.streaming,
+        db_path=args.db,
+        profile=args.profile,
+        telemetry=telemetry,
+        cache=cache,
+    ):
+        record = {"path": result.path, "error": result.error}
+        if result.data is not None:
+            record.update(to_json(result.data))
+        args.output.write(json.dumps(record, default=str) + "\n")
+        if args.profile:
+            results.append(result._replace(data=None))
+
+    if args.profile:
+        print_profile(results, startup, time.perf_counter() - start)
+
+    if telemetry is not None:
+        db_conn = codeDatabase.connect(args.db)
+        try:
+            json.dump(telemetry.report(db_conn), args.telemetry, indent=2)
+        finally:
+            db_conn.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
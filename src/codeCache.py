@@ -0,0 +1,244 @@
+"""
+In-memory caches for code database lookups.
+
+The caches are module-level, so every `Parser` in a process shares them. Small
+tables can be loaded in full with `preload` so they never hit the database, and
+lookups that found nothing are remembered in `missing` so they don't either.
+
+Every key starts with the `database_key` of the database it came from, so
+several databases can share the caches, and when a database is updated
+everything cached for its old version is dropped.
+"""
+
+from collections import OrderedDict
+import os
+import threading
+
+import codeData
+
+DEFAULT_SIZE = 4096
+
+# small tables that are worth keeping in memory in full
+PRELOAD_TABLES = ("hl7_address_use",)
+
+# individual codes to keep from large tables
+PRELOAD_CODES = {
+    "snomed": [code for code in codeData.snomed_codes if code != "no info"],
+}
+
+
+class LRUCache:
+    """
+    A bounded, thread-safe least-recently-used cache.
+
+    Keeps `hits`, `misses` and `evictions` counts. Pinned entries don't count
+    towards `maxsize` and are never evicted.
+    """
+
+    def __init__(self, maxsize=DEFAULT_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._pinned = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries) + len(self._pinned)
+
+    def get(self, key):
+        """
+        Get a cached value, or `None` if there isn't one.
+        """
+        with self._lock:
+            if key in self._pinned:
+                self.hits += 1
+                return self._pinned[key]
+
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Cache a value, evicting the least recently used entries if full.
+        """
+        with self._lock:
+            if key in self._pinned:
+                return
+
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._shrink()
+
+    def pin(self, key, value):
+        """
+        Cache a value permanently.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+            self._pinned[key] = value
+
+    def pin_many(self, items):
+        """
+        Cache many `(key, value)` pairs permanently.
+        """
+        with self._lock:
+            for key, value in items:
+                self._entries.pop(key, None)
+                self._pinned[key] = value
+
+    def discard(self, match):
+        """
+        Remove every entry, pinned or not, whose key `match(key)` is true for.
+        """
+        with self._lock:
+            for entries in (self._entries, self._pinned):
+                for key in [key for key in entries if match(key)]:
+                    del entries[key]
+
+    def resize(self, maxsize):
+        """
+        Change the maximum size, evicting entries if needed.
+        """
+        with self._lock:
+            self.maxsize = maxsize
+            self._shrink()
+
+    def clear(self):
+        """
+        Empty the cache (including pinned entries) and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._pinned.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        Get the cache counters as a dict.
+        """
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _shrink(self):
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+
+# keys all start with a `database_key`, shown here as `db`
+
+# (db, codesystem, code) -> description, (db, "reverse_" + codesystem, description)
+# -> code and (db, "vitals", vital) -> LOINC codes
+codes = LRUCache()
+# (db, codesystem OID) -> table name
+codesystems = LRUCache()
+# (db, codesystem, code) and (db, "codesystems", OID) -> True for lookups that
+# found nothing
+missing = LRUCache()
+
+_databases = {}  # database path -> its current key
+_databases_lock = threading.Lock()
+
+
+def database_key(db_path, version):
+    """
+    Get the key the caches use for the database at `db_path`, at `version` (see
+    `codeDatabase.version`).
+
+    If the database was cached at a different version, everything cached for that
+    version (including pinned entries) is dropped.
+    """
+    key = (os.path.abspath(db_path), version)
+    with _databases_lock:
+        old = _databases.get(key[0])
+        if old == key:
+            return key
+        _databases[key[0]] = key
+
+    if old is not None:
+        for cache in (codes, codesystems, missing):
+            cache.discard(lambda cache_key: cache_key[0] == old)
+    return key
+
+
+def configure(maxsize):
+    """
+    Set the maximum size of the shared caches.
+    """
+    codes.resize(maxsize)
+    codesystems.resize(maxsize)
+    missing.resize(maxsize)
+
+
+def stats():
+    """
+    Get the counters for each shared cache.
+    """
+    return {
+        "codes": codes.stats(),
+        "codesystems": codesystems.stats(),
+        "missing": missing.stats(),
+    }
+
+
+def clear():
+    """
+    Empty the shared caches.
+    """
+    codes.clear()
+    codesystems.clear()
+    missing.clear()
+    with _databases_lock:
+        _databases.clear()
+
+
+def _pin_rows(database, table, rows):
+    for code, description in rows:
+        codes.pin((database, table, code), description)
+        codes.pin((database, "reverse_" + table, description), code)
+
+
+def preload(db_conn, database, tables=PRELOAD_TABLES, table_codes=None):
+    """
+    Load the `codesystems` table, the tables in `tables` and the codes in
+    `table_codes` (defaulting to `PRELOAD_CODES`) into the shared caches, under
+    `database` (its `database_key`).
+    """
+    if table_codes is None:
+        table_codes = PRELOAD_CODES
+
+    cursor = db_conn.cursor()
+
+    for oid, name in cursor.execute(
+        "select codesystem_id, codesystem_name from codesystems"
+    ):
+        codesystems.pin((database, oid), name)
+
+    for table in tables:
+        _pin_rows(
+            database, table, cursor.execute(f"SELECT code, description FROM {table}")
+        )
+
+    for table, wanted in table_codes.items():
+        placeholders = ", ".join("?" * len(wanted))
+        _pin_rows(
+            database,
+            table,
+            cursor.execute(
+                f"SELECT code, description FROM {table} WHERE code IN ({placeholders})",
+                wanted,
+            ),
+        )
@@ -89,3 +89,86 @@ hl7_phone_codes = {
     "TMP": "temporary address",
     "WP": "work place",
 }
+
+
+# LOINC codes of the document sections, by lowercase title (including the other
+# titles they go by)
+section_codes = {
+    "advance directives": ("42348-3",),
+    "allergies": ("48765-2",),
+    "allergies, adverse reactions, alerts": ("48765-2",),
+    "assessment": ("51848-0",),
+    "assessment and plan": ("51847-2",),
+    "chief complaint": ("10154-3",),
+    "chief complaint and reason for visit": ("46239-0",),
+    "encounters": ("46240-8",),
+    "family history": ("10157-6",),
+    "functional status": ("47420-5",),
+    "goals": ("61146-7",),
+    "health concerns": ("75310-3",),
+    "history of encounters": ("46240-8",),
+    "history of immunizations": ("11369-6",),
+    "history of medication use": ("10160-0",),
+    "immunizations": ("11369-6",),
+    "instructions": ("69730-0",),
+    "medical equipment": ("46264-8",),
+    "medications": ("10160-0",),
+    "mental status": ("10190-7",),
+    "payers": ("48768-6",),
+    "payment sources": ("48768-6",),
+    "plan of care": ("18776-5",),
+    "problem list": ("11450-4",),
+    "problems": ("11450-4",),
+    "procedures": ("47519-4",),
+    "reason for visit": ("29299-5",),
+    "results": ("30954-2",),
+    "social history": ("29762-2",),
+    "vital signs": ("8716-3", "85353-1"),
+    "vital signs, weight, height, head circumference, oxygen saturation & bmi panel": (
+        "85353-1",
+    ),
+}
+
+# LOINC codes of the document sections, by C-CDA section templateId
+section_template_ids = {
+    "2.16.840.1.113883.10.20.22.2.1": "10160-0",  # medications
+    "2.16.840.1.113883.10.20.22.2.1.1": "10160-0",
+    "2.16.840.1.113883.10.20.22.2.2": "11369-6",  # immunizations
+    "2.16.840.1.113883.10.20.22.2.2.1": "11369-6",
+    "2.16.840.1.113883.10.20.22.2.3": "30954-2",  # results
+    "2.16.840.1.113883.10.20.22.2.3.1": "30954-2",
+    "2.16.840.1.113883.10.20.22.2.4": "8716-3",  # vital signs
+    "2.16.840.1.113883.10.20.22.2.4.1": "8716-3",
+    "2.16.840.1.113883.10.20.22.2.5": "11450-4",  # problems
+    "2.16.840.1.113883.10.20.22.2.5.1": "11450-4",
+    "2.16.840.1.113883.10.20.22.2.6": "48765-2",  # allergies
+    "2.16.840.1.113883.10.20.22.2.6.1": "48765-2",
+    "2.16.840.1.113883.10.20.22.2.7": "47519-4",  # procedures
+    "2.16.840.1.113883.10.20.22.2.7.1": "47519-4",
+    "2.16.840.1.113883.10.20.22.2.8": "51848-0",  # assessment
+    "2.16.840.1.113883.10.20.22.2.9": "51847-2",  # assessment and plan
+    "2.16.840.1.113883.10.20.22.2.10": "18776-5",  # plan of care
+    "2.16.840.1.113883.10.20.22.2.12": "29299-5",  # reason for visit
+    "2.16.840.1.113883.10.20.22.2.13": "46239-0",  # chief complaint and reason
+    "2.16.840.1.113883.10.20.22.2.14": "47420-5",  # functional status
+    "2.16.840.1.113883.10.20.22.2.15": "10157-6",  # family history
+    "2.16.840.1.113883.10.20.22.2.17": "29762-2",  # social history
+    "2.16.840.1.113883.10.20.22.2.18": "48768-6",  # payers
+    "2.16.840.1.113883.10.20.22.2.21": "42348-3",  # advance directives
+    "2.16.840.1.113883.10.20.22.2.21.1": "42348-3",
+    "2.16.840.1.113883.10.20.22.2.22": "46240-8",  # encounters
+    "2.16.840.1.113883.10.20.22.2.22.1": "46240-8",
+    "2.16.840.1.113883.10.20.22.2.23": "46264-8",  # medical equipment
+    "2.16.840.1.113883.10.20.22.2.45": "69730-0",  # instructions
+    "2.16.840.1.113883.10.20.22.2.56": "10190-7",  # mental status
+    "2.16.840.1.113883.10.20.22.2.58": "75310-3",  # health concerns
+    "2.16.840.1.113883.10.20.22.2.60": "61146-7",  # goals
+    "1.3.6.1.4.1.19376.1.5.3.1.1.13.2.1": "10154-3",  # chief complaint
+}
+
+# LOINC descriptions of each vital sign, for finding its codes in the database
+vital_descriptions = {
+    "Height": ("Height", "Body height"),
+    "Weight": ("Weight", "Body weight"),
+    "BMI": ("Body mass index",),
+}
@@ -0,0 +1,147 @@
+"""
+Opening the code database.
+
+The database is built by `buildCodeDatabase.py` and only read by the parser, so it
+is opened read-only, which lets many processes share the file without locking.
+Parsers get their connections from a `ConnectionProvider`, so each thread
+connects once instead of once per document.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3 as sqlite
+import threading
+from urllib.request import pathname2url
+
+DB_PATH = "codeDatabase.db"
+SCHEMA_VERSION = 1
+
+MMAP_SIZE = 256 * 1024 * 1024
+
+
+def connect(path=DB_PATH, read_only=True, immutable=False, check_same_thread=True):
+    """
+    Connect to the code database.
+
+    Read-only connections are memory-mapped. Pass `immutable=True` if nothing
+    will write to the file while it's open to skip file locking entirely.
+    """
+    if not read_only:
+        return sqlite.connect(path, check_same_thread=check_same_thread)
+
+    uri = "file:" + pathname2url(os.path.abspath(path)) + "?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+
+    conn = sqlite.connect(uri, uri=True, check_same_thread=check_same_thread)
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    return conn
+
+
+def get_metadata(conn):
+    """
+    Get the `metadata` table (schema version, build time, sources) as a dict.
+
+    Returns an empty dict for databases built before the table existed.
+    """
+    try:
+        return dict(conn.execute("SELECT key, value FROM metadata"))
+    except sqlite.OperationalError:
+        return {}
+
+
+def version(conn):
+    """
+    Get a short hash of the `metadata` table, which changes whenever the database
+    is rebuilt or updated.
+    """
+    metadata = json.dumps(get_metadata(conn), sort_keys=True).encode()
+    return hashlib.sha256(metadata).hexdigest()[:16]
+
+
+class ConnectionProvider:
+    """
+    Hands out read-only connections to one database file, one per thread.
+
+    Connections are reused for the life of the thread and reopened after a fork,
+    since SQLite connections can't be shared between processes.
+    """
+
+    def __init__(self, path=DB_PATH, immutable=False):
+        self.path = path
+        self.immutable = immutable
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+        self._pid = os.getpid()
+
+    def connection(self):
+        """
+        Get this thread's connection, opening it if needed.
+        """
+        if self._pid != os.getpid():  # forked, don't touch the parent's connections
+            self._reset()
+
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # only ever used by this thread, but `close` may run on another one
+            conn = connect(self.path, immutable=self.immutable, check_same_thread=False)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def version(self):
+        """
+        Get the database's `version`, only reading the `metadata` again if another
+        connection has written to the file since this thread last checked.
+        """
+        conn = self.connection()
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        seen = getattr(self._local, "version", None)
+        if seen is None or seen[0] != data_version:
+            seen = self._local.version = (data_version, version(conn))
+        return seen[1]
+
+    def close(self):
+        """
+        Close every connection this provider has opened.
+        """
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+            self._local = threading.local()
+
+    def _reset(self):
+        # the lock may have been held by another thread when we forked
+        self._lock = threading.Lock()
+        self._connections = []
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(path=DB_PATH):
+    """
+    Get the shared `ConnectionProvider` for `path`.
+    """
+    key = os.path.abspath(path)
+    with _providers_lock:
+        provider = _providers.get(key)
+        if provider is None:
+            provider = _providers[key] = ConnectionProvider(path)
+    return provider
+
+
+def close_all():
+    """
+    Close the connections of every shared provider.
+    """
+    with _providers_lock:
+        for provider in _providers.values():
+            provider.close()
@@ -0,0 +1,224 @@
+"""
+A snapshot of the most used codes, saved next to the code database.
+
+The parser keeps looking up the same few codes: section and vital sign LOINCs,
+smoking status SNOMEDs, and the small HL7 and CDC race/ethnicity tables. `write`
+exports those from `codeDatabase.db` into one pickle, and `install` loads it
+into `codeCache` (pinned), so they never hit SQLite. Everything else still goes
+to the database.
+
+The snapshot records the database's `metadata`, and is only used if it still
+matches, so rebuilding the database can't leave a stale snapshot in use.
+`buildCodeDatabase.py` writes a new one after every build.
+
+Usage::
+
+    python codeSnapshot.py --db codeDatabase.db
+"""
+
+import argparse
+import os
+import pickle
+import threading
+
+import codeCache
+import codeData
+import codeDatabase
+
+FORMAT_VERSION = 1
+
+# tables small enough to keep in full (skipped if the database doesn't have them)
+HOT_TABLES = ("hl7_address_use", "administrative_gender", "cdc_rec")
+
+VITAL_LOINCS = (
+    "8302-2",  # height
+    "8306-3",  # height (lying)
+    "3141-9",  # weight
+    "29463-7",  # weight
+    "39156-5",  # BMI
+    "8480-6",  # systolic
+    "8462-4",  # diastolic
+    "8867-4",  # heart rate
+    "9279-1",  # respiratory rate
+    "8310-5",  # temperature
+    "59408-5",  # O2 saturation (pulse oximetry)
+    "2710-2",  # O2 saturation
+    "8287-5",  # head circumference
+)
+
+# individual codes to keep from large tables
+HOT_CODES = {
+    "loinc": sorted(
+        set(VITAL_LOINCS)
+        | {code for codes in codeData.section_codes.values() for code in codes}
+        | set(codeData.section_template_ids.values())
+    ),
+    "snomed": [code for code in codeData.snomed_codes if code != "no info"],
+}
+
+_lock = threading.Lock()
+_installed = {}  # database path -> (database key, whether its snapshot was installed)
+
+
+def snapshot_path(db_path=codeDatabase.DB_PATH):
+    """
+    Get the path of the snapshot for the database at `db_path`.
+    """
+    return os.path.splitext(db_path)[0] + ".snapshot"
+
+
+def _tables(cursor):
+    return {row[0] for row in cursor.execute("SELECT name FROM sqlite_master")}
+
+
+def export(db_conn):
+    """
+    Read the hot codes from the database into a snapshot dict.
+    """
+    cursor = db_conn.cursor()
+    tables = _tables(cursor)
+    codes = {}
+
+    def add_rows(table, rows):
+        for code, description in rows:
+            codes[(table, code)] = description
+            codes.setdefault(("reverse_" + table, description), code)
+
+    for table in HOT_TABLES:
+        if table in tables:
+            add_rows(table, cursor.execute(f"SELECT code, description FROM {table}"))
+
+    for table, wanted in HOT_CODES.items():
+        if table in tables:
+            placeholders = ", ".join("?" * len(wanted))
+            add_rows(
+                table,
+                cursor.execute(
+                    f"SELECT code, description FROM {table} "
+                    f"WHERE code IN ({placeholders})",
+                    wanted,
+                ),
+            )
+
+    if "loinc" in tables:
+        for vital, descriptions in codeData.vital_descriptions.items():
+            found = []
+            for description in descriptions:
+                found.extend(
+                    row[0]
+                    for row in cursor.execute(
+                        "SELECT code FROM loinc WHERE description = ?", (description,)
+                    )
+                )
+            codes[("vitals", vital)] = tuple(found)
+
+    codesystems = {}
+    if "codesystems" in tables:
+        codesystems = dict(
+            cursor.execute("SELECT codesystem_id, codesystem_name FROM codesystems")
+        )
+
+    return {
+        "format": FORMAT_VERSION,
+        "metadata": codeDatabase.get_metadata(db_conn),
+        "codes": codes,
+        "codesystems": codesystems,
+    }
+
+
+def write(db_path=codeDatabase.DB_PATH, path=None):
+    """
+    Export the snapshot of the database at `db_path` to `path` (by default
+    `snapshot_path(db_path)`). Returns the number of codes saved.
+    """
+    if path is None:
+        path = snapshot_path(db_path)
+
+    conn = codeDatabase.connect(db_path)
+    try:
+        snapshot = export(conn)
+    finally:
+        conn.close()
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+    return len(snapshot["codes"])
+
+
+def read(path, db_conn):
+    """
+    Load a snapshot, returning `None` if it's missing or doesn't match the
+    database `db_conn` is connected to.
+    """
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+
+    if snapshot.get("format") != FORMAT_VERSION:
+        return None
+    metadata = codeDatabase.get_metadata(db_conn)
+    if not metadata or snapshot["metadata"] != metadata:  # stale or unversioned
+        return None
+    return snapshot
+
+
+def install(db_path=codeDatabase.DB_PATH, db_conn=None, database=None):
+    """
+    Pin the snapshot of the database at `db_path` into `codeCache`, under
+    `database` (its `codeCache.database_key`), once per version of the database.
+    Returns whether a current snapshot was found.
+
+    Once the database is updated, its new key installs the new snapshot (the old
+    one's pins are dropped by `codeCache.database_key`). After `codeCache.clear`,
+    call `forget` to install it again.
+    """
+    key = os.path.abspath(db_path)
+    if db_conn is None:
+        db_conn = codeDatabase.get_provider(db_path).connection()
+    if database is None:
+        database = codeCache.database_key(db_path, codeDatabase.version(db_conn))
+
+    with _lock:
+        installed = _installed.get(key)
+        if installed is not None and installed[0] == database:
+            return installed[1]
+
+        snapshot = read(snapshot_path(db_path), db_conn)
+        if snapshot is not None:
+            codeCache.codes.pin_many(
+                ((database,) + code_key, value)
+                for code_key, value in snapshot["codes"].items()
+            )
+            codeCache.codesystems.pin_many(
+                ((database, oid), name) for oid, name in snapshot["codesystems"].items()
+            )
+
+        _installed[key] = (database, snapshot is not None)
+        return snapshot is not None
+
+
+def forget():
+    """
+    Forget which snapshots have been installed.
+    """
+    with _lock:
+        _installed.clear()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--db", default=codeDatabase.DB_PATH, help="code database")
+    arg_parser.add_argument("--out", help="snapshot file (default: next to the db)")
+    args = arg_parser.parse_args(argv)
+
+    count = write(args.db, args.out)
+    print(f"saved {count} codes to {args.out or snapshot_path(args.db)}")
+
+
+if __name__ == "__main__":
+    main()
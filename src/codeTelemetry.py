@@ -0,0 +1,187 @@
+"""
+Telemetry for code database lookups.
+
+Shows which codes and codesystem OIDs are missing from the database and how
+long each table's queries take. `report` runs `EXPLAIN QUERY PLAN` on every
+distinct query, to show whether it used an index or scanned the table.
+
+Recording is off unless `enable` is called. Lookups answered from `codeCache`
+are not recorded, except for codes in `codeCache.missing`, which still count
+as missing. `batch.parse_many(telemetry=...)` collects it from every worker::
+
+    telemetry = codeTelemetry.Telemetry()
+    for result in batch.parse_many(paths, telemetry=telemetry):
+        ...
+    print(json.dumps(telemetry.report(codeDatabase.connect()), indent=2))
+"""
+
+from collections import Counter
+import threading
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1)
+
+recorder = None  # the `Telemetry` being recorded to, if enabled
+
+
+class Telemetry:
+    """
+    Missing codes, missing codesystem OIDs and query latencies, by table.
+    """
+
+    def __init__(self):
+        self.missing_codes = Counter()  # (table, code) -> misses
+        self.missing_codesystems = Counter()  # OID -> misses
+        self.latency = {}  # table -> [count per bucket (last is +Inf), total seconds]
+        self.queries = {}  # (table, sql) -> [count, example params]
+        self._lock = threading.Lock()
+
+    def record_query(self, table, sql, params, seconds):
+        """
+        Record a query on `table` that took `seconds`.
+        """
+        with self._lock:
+            latency = self.latency.get(table)
+            if latency is None:
+                latency = self.latency[table] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+            bucket = 0
+            while bucket < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[bucket]:
+                bucket += 1
+            latency[0][bucket] += 1
+            latency[1] += seconds
+
+            query = self.queries.get((table, sql))
+            if query is None:
+                self.queries[(table, sql)] = [1, params]
+            else:
+                query[0] += 1
+
+    def record_missing(self, table, code):
+        """
+        Record a code that isn't in `table`.
+        """
+        with self._lock:
+            self.missing_codes[(table, code)] += 1
+
+    def record_missing_codesystem(self, oid):
+        """
+        Record a codesystem OID that isn't in the `codesystems` table.
+        """
+        with self._lock:
+            self.missing_codesystems[oid] += 1
+
+    def merge(self, other):
+        """
+        Add everything recorded in another `Telemetry` to this one.
+        """
+        with self._lock:
+            self.missing_codes.update(other.missing_codes)
+            self.missing_codesystems.update(other.missing_codesystems)
+            for table, (counts, seconds) in other.latency.items():
+                latency = self.latency.setdefault(
+                    table, [[0] * (len(LATENCY_BUCKETS) + 1), 0.0]
+                )
+                latency[0] = [a + b for a, b in zip(latency[0], counts)]
+                latency[1] += seconds
+            for key, (count, params) in other.queries.items():
+                query = self.queries.setdefault(key, [0, params])
+                query[0] += count
+
+    def drain(self):
+        """
+        Get a copy of everything recorded so far and start again from empty.
+        """
+        copy = Telemetry()
+        with self._lock:
+            copy.missing_codes, self.missing_codes = self.missing_codes, Counter()
+            copy.missing_codesystems = self.missing_codesystems
+            self.missing_codesystems = Counter()
+            copy.latency, self.latency = self.latency, {}
+            copy.queries, self.queries = self.queries, {}
+        return copy
+
+    def __bool__(self):
+        return bool(self.queries or self.missing_codes or self.missing_codesystems)
+
+    def __getstate__(self):  # the lock can't be pickled (for batch workers)
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def report(self, db_conn=None, top=20):
+        """
+        Summarize everything recorded as a dict (JSON serializable).
+
+        `top` limits the missing codes and OIDs to the most common ones. With a
+        `db_conn`, each distinct query is run through `EXPLAIN QUERY PLAN`.
+        """
+        with self._lock:
+            report = {
+                "missing_codes": [
+                    {"table": table, "code": code, "count": count}
+                    for (table, code), count in self.missing_codes.most_common(top)
+                ],
+                "missing_codesystems": [
+                    {"oid": oid, "count": count}
+                    for oid, count in self.missing_codesystems.most_common(top)
+                ],
+                "tables": {},
+                "queries": [],
+            }
+
+            for table, (counts, seconds) in sorted(self.latency.items()):
+                buckets = {}
+                total = 0
+                for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                    total += count
+                    buckets[str(bound)] = total  # cumulative, like Prometheus
+                report["tables"][table] = {
+                    "queries": total,
+                    "seconds": seconds,
+                    "latency_buckets": buckets,
+                }
+
+            queries = sorted(self.queries.items(), key=lambda item: -item[1][0])
+
+        for (table, sql), (count, params) in queries:
+            query = {"table": table, "sql": sql, "count": count}
+            if db_conn is not None:
+                query["plan"] = explain(db_conn, sql, params)
+                query["uses_index"] = not any(
+                    detail.startswith("SCAN") for detail in query["plan"]
+                )
+            report["queries"].append(query)
+
+        return report
+
+
+def explain(db_conn, sql, params=()):
+    """
+    Get the `EXPLAIN QUERY PLAN` details of a query, one string per step.
+    """
+    rows = db_conn.execute("EXPLAIN QUERY PLAN " + sql, params)
+    return [row[-1] for row in rows]
+
+
+def enable(telemetry=None):
+    """
+    Start recording to `telemetry` (or a new `Telemetry`) in this process.
+    Returns it.
+    """
+    global recorder
+    if telemetry is None:
+        telemetry = Telemetry()
+    recorder = telemetry
+    return recorder
+
+
+def disable():
+    """
+    Stop recording.
+    """
+    global recorder
+    recorder = None
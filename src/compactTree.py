@@ -0,0 +1,320 @@
+"""
+A compact, read-only representation of parsed CCDAs.
+
+xmltodict makes a dict for every element, with a string key for every attribute,
+so a parsed document is many times the size of its XML. A `Document` keeps the
+whole tree in a few flat arrays instead: each element is a row of integers (its
+tag, first child, next sibling, first attribute and text). Tag and attribute
+names are interned, and attribute values and text are stored once per document,
+so the OIDs and codes repeated all through a CCDA cost 4 bytes per use.
+
+`Element` is a view of one row that acts like the dict xmltodict would have
+produced (it's a read-only `Mapping`), so the parser and `extract` read either
+one. Views are made as the tree is walked and hold nothing but their index::
+
+    patient = parser.Parser("CCDAs/Sample CCDA.xml", compact=True)
+    patient.ccda_data["ClinicalDocument"]["recordTarget"]["patientRole"]["id"]
+
+`loader.parse_compact` builds a `Document` straight from the XML, and
+`from_dict` converts an existing xmltodict-shaped document.
+"""
+
+from array import array
+from collections.abc import Mapping
+import sys
+
+NONE = -1  # no child, sibling or text
+
+# the columns of a row of `Document.elements`
+TAG, FIRST_CHILD, NEXT_SIBLING, TEXT, FIRST_ATTRIBUTE = range(5)
+ROW = 5
+
+
+class Document:
+    """
+    The element and attribute tables of a parsed document.
+
+    `elements` has a row of `ROW` integers per element, in document order. Element
+    0 stands for the document itself, so its only child is the root element, and
+    a last row marks the end of the attributes. `attributes` has a `(name, value)`
+    pair of integers per attribute, indexing `names` and `strings`.
+
+    The items of each element that has been looked into are indexed as they're
+    needed (see `items`), so looking up a key doesn't walk the element's children.
+    Only the elements that are read are indexed, but reading all of them (with
+    `Element.to_dict`, say) costs about what xmltodict's dicts would have.
+    """
+
+    def __init__(self):
+        self.names = []  # interned tag and attribute ("@name") names
+        self.name_ids = {}
+        self.strings = []  # attribute values and text
+        self.elements = array("i")
+        self.attributes = array("i")
+        self._items = {}  # element -> its keys and values, once looked into
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_items"]  # rebuilt as it's used
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._items = {}
+
+    def __len__(self):
+        return len(self.elements) // ROW - 1
+
+    def nbytes(self):
+        """
+        The size of the tables and strings, in bytes.
+        """
+        size = sum(
+            sys.getsizeof(table)
+            for table in (
+                self.elements,
+                self.attributes,
+                self.strings,
+                self.names,
+                self.name_ids,
+            )
+        )
+        return size + sum(sys.getsizeof(string) for string in self.strings)
+
+    def value(self, index):
+        """
+        What xmltodict would have produced for element `index`: its text (or
+        `None`) if it has no attributes or children, otherwise an `Element`.
+        """
+        row = index * ROW
+        elements = self.elements
+        if (
+            elements[row + FIRST_CHILD] == NONE
+            and elements[row + FIRST_ATTRIBUTE] == elements[row + ROW + FIRST_ATTRIBUTE]
+        ):
+            text = elements[row + TEXT]
+            return None if text == NONE else self.strings[text]
+        return Element(self, index)
+
+    def children(self, index):
+        """
+        Yield the indexes of element `index`'s children, in document order.
+        """
+        elements = self.elements
+        child = elements[index * ROW + FIRST_CHILD]
+        while child != NONE:
+            yield child
+            child = elements[child * ROW + NEXT_SIBLING]
+
+    def items(self, index):
+        """
+        The dict xmltodict would have made for element `index` (without going
+        any deeper, so children are `value`s). Built the first time it's asked
+        for and then kept.
+        """
+        items = self._items.get(index)
+        if items is not None:
+            return items
+
+        names = self.names
+        attributes = self.attributes
+        items = {
+            names[attributes[i]]: self.strings[attributes[i + 1]]
+            for i in self.attribute_range(index)
+        }
+        elements = self.elements
+        for child in self.children(index):
+            tag = names[elements[child * ROW + TAG]]
+            value = self.value(child)
+            if tag not in items:
+                items[tag] = value
+            elif isinstance(items[tag], list):
+                items[tag].append(value)
+            else:
+                items[tag] = [items[tag], value]
+        text = elements[index * ROW + TEXT]
+        if text != NONE:
+            items["#text"] = self.strings[text]
+
+        self._items[index] = items
+        return items
+
+    def attribute_range(self, index):
+        """
+        The positions of element `index`'s attributes in `attributes`.
+        """
+        row = index * ROW
+        return range(
+            self.elements[row + FIRST_ATTRIBUTE] * 2,
+            self.elements[row + ROW + FIRST_ATTRIBUTE] * 2,
+            2,
+        )
+
+    def root(self):
+        """
+        The document as an `Element` shaped like `xmltodict.parse`'s output.
+        """
+        return Element(self, 0)
+
+
+class Element(Mapping):
+    """
+    A view of one element of a `Document`, with the keys xmltodict would have
+    given it: `@` attributes, then child tags, then `#text`. A tag that appears
+    more than once gives a list.
+    """
+
+    __slots__ = ("document", "index")
+
+    def __init__(self, document, index):
+        self.document = document
+        self.index = index
+
+    @property
+    def tag(self):
+        """
+        The element's tag (`None` for the document).
+        """
+        return self.document.names[self.document.elements[self.index * ROW + TAG]]
+
+    def __getitem__(self, key):
+        return self.document.items(self.index)[key]
+
+    def __contains__(self, key):
+        return key in self.document.items(self.index)
+
+    def get(self, key, default=None):
+        return self.document.items(self.index).get(key, default)
+
+    def __iter__(self):
+        return iter(self.document.items(self.index))
+
+    def __len__(self):
+        return len(self.document.items(self.index))
+
+    def __reduce__(self):
+        return Element, (self.document, self.index)
+
+    def __repr__(self):
+        return f"<Element {self.tag} {list(self)}>"
+
+    def to_dict(self):
+        """
+        Convert to the nested dicts xmltodict would have produced.
+        """
+        return _to_dict(self)
+
+
+def _to_dict(value):
+    if isinstance(value, Element):
+        return {key: _to_dict(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_to_dict(item) for item in value]
+    return value
+
+
+class Builder:
+    """
+    Builds a `Document` from `start` and `end` calls in document order.
+    """
+
+    def __init__(self):
+        self.document = Document()
+        self._strings = {}  # string -> index, while building
+        self._attribute_names = {}  # name (without "@") -> index in `names`
+        self._stack = [0]  # open elements
+        self._last_child = [NONE]  # of each open element
+        self.document.names.append(None)
+        self.document.elements.extend((0, NONE, NONE, NONE, 0))
+
+    def _name(self, name):
+        ids = self.document.name_ids
+        name_id = ids[name] = len(self.document.names)
+        self.document.names.append(sys.intern(name))
+        return name_id
+
+    def _string(self, string):
+        string_id = self._strings.get(string)
+        if string_id is None:
+            string_id = self._strings[string] = len(self.document.strings)
+            self.document.strings.append(string)
+        return string_id
+
+    def start(self, tag, attributes):
+        """
+        Open an element. `attributes` are `(name, value)` pairs, with names
+        as xmltodict would give them (without the `@`).
+        """
+        doc = self.document
+        elements = doc.elements
+        index = len(elements) // ROW
+
+        tag_id = doc.name_ids.get(tag)
+        if tag_id is None:
+            tag_id = self._name(tag)
+        elements.extend((tag_id, NONE, NONE, NONE, len(doc.attributes) // 2))
+
+        for name, value in attributes:
+            name_id = self._attribute_names.get(name)
+            if name_id is None:
+                name_id = self._attribute_names[name] = self._name("@" + name)
+            doc.attributes.extend((name_id, self._string(value)))
+
+        last = self._last_child[-1]
+        if last == NONE:
+            elements[self._stack[-1] * ROW + FIRST_CHILD] = index
+        else:
+            elements[last * ROW + NEXT_SIBLING] = index
+        self._last_child[-1] = index
+        self._stack.append(index)
+        self._last_child.append(NONE)
+
+    def end(self, text=None):
+        """
+        Close the open element, with its (stripped) text.
+        """
+        index = self._stack.pop()
+        self._last_child.pop()
+        if text:
+            self.document.elements[index * ROW + TEXT] = self._string(text)
+
+    def finish(self):
+        """
+        Close the document and return it as an `Element`.
+        """
+        while len(self._stack) > 1:
+            self.end()
+        doc = self.document
+        doc.elements.extend((NONE, NONE, NONE, NONE, len(doc.attributes) // 2))
+        self._strings = self._attribute_names = None
+        return doc.root()
+
+
+def _add(builder, tag, value):
+    if isinstance(value, list):
+        for item in value:
+            _add(builder, tag, item)
+        return
+    if not isinstance(value, Mapping):
+        builder.start(tag, ())
+        builder.end(value)
+        return
+
+    builder.start(
+        tag, [(key[1:], item) for key, item in value.items() if key[0] == "@"]
+    )
+    for key, item in value.items():
+        if key[0] not in "@#":
+            _add(builder, key, item)
+    builder.end(value.get("#text"))
+
+
+def from_dict(ccda_data):
+    """
+    Convert a document shaped like the output of `xmltodict.parse` (including
+    `loader.parse_sections`) into a compact one.
+    """
+    builder = Builder()
+    for tag, value in ccda_data.items():
+        _add(builder, tag, value)
+    return builder.finish()
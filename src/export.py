@@ -0,0 +1,317 @@
+"""
+Export CCDAs to columnar files.
+
+Streams directories (or zip/tar archives) of CCDAs through `batch.parse_many` and
+writes patient demographics, vitals and insurance into one file per table:
+Parquet or Arrow IPC if pyarrow is installed, CSV otherwise. Rows are written in
+batches (one row group each), so memory use doesn't grow with the corpus.
+
+Usage::
+
+    python export.py CCDAs/ partner.zip --out exported --format parquet --jobs 8
+"""
+
+import argparse
+import csv
+import os
+
+import batch
+import codeDatabase
+
+FIELDS = [
+    "demographics",
+    "smoking_status",
+    "height_inches",
+    "weight",
+    "bmi",
+    "insurance",
+    "vitals_table",
+]
+
+# columns and their (pyarrow) types for each output table
+TABLES = {
+    "patients": {
+        "path": "string",
+        "error": "string",
+        "name": "string",
+        "gender": "string",
+        "dob": "string",
+        "race": "string",
+        "ethnicity": "string",
+        "languages": "string",
+        "address": "string",
+        "phone": "string",
+        "phone_type": "string",
+        "smoking_status": "string",
+        "smoking_date": "string",
+        "height_in": "float64",
+        "weight_lb": "float64",
+        "bmi": "float64",
+    },
+    "vitals": {
+        "path": "string",
+        "code": "string",
+        "name": "string",
+        "time": "string",
+        "value": "float64",
+        "unit": "string",
+        "si_value": "float64",
+        "si_unit": "string",
+    },
+    "insurance": {
+        "path": "string",
+        "company_name": "string",
+        "company_address": "string",
+        "company_phone": "string",
+        "guarantor_name": "string",
+        "guarantor_address": "string",
+        "guarantor_phone": "string",
+        "subscriber_id": "string",
+    },
+}
+
+EXTENSIONS = {"parquet": "parquet", "arrow": "arrow", "csv": "csv"}
+
+
+def _have_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class CSVWriter:
+    """
+    Writes rows to a CSV file.
+    """
+
+    def __init__(self, path, columns):
+        self._file = open(path, "w", newline="", encoding="utf8")
+        self._writer = csv.DictWriter(self._file, fieldnames=list(columns))
+        self._writer.writeheader()
+
+    def write(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._file.close()
+
+
+class ArrowWriter:
+    """
+    Writes rows to a Parquet (one row group per `write`) or Arrow IPC file.
+    """
+
+    def __init__(self, path, columns, fmt):
+        import pyarrow as pa
+
+        self._pa = pa
+        self._schema = pa.schema(
+            [(name, getattr(pa, type_name)()) for name, type_name in columns.items()]
+        )
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+
+            self._writer = pq.ParquetWriter(path, self._schema)
+        else:
+            self._writer = pa.ipc.new_file(path, self._schema)
+
+    def write(self, rows):
+        self._writer.write_table(self._pa.Table.from_pylist(rows, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+def _no_info(value):
+    """
+    Turn the parser's `"no info"` into `None` (null).
+    """
+    return None if value == "no info" else value
+
+
+def _number(value):
+    value = _no_info(value)
+    return None if value is None else float(value)
+
+
+def _phone(telecom):
+    return _no_info(telecom[0]) if isinstance(telecom, list) else None
+
+
+def patient_rows(path, data, error=None):
+    """
+    Build the `patients` row for a parsed document. Fields missing from `data`
+    (because they failed, see `error`) are left null.
+    """
+    row = dict.fromkeys(TABLES["patients"])
+    row.update(path=path, error=error)
+
+    demographics = data.get("demographics")
+    if demographics is not None:
+        row.update(
+            name=_no_info(demographics.name),
+            gender=_no_info(demographics.gender),
+            dob=_no_info(demographics.dob),
+            race=_no_info(demographics.race),
+            ethnicity=_no_info(demographics.ethnicity),
+            languages="; ".join(demographics.languages),
+            address=_no_info(demographics.address),
+            phone=_no_info(demographics.phone),
+            phone_type=_no_info(demographics.phone_type),
+        )
+
+    if "smoking_status" in data:
+        smoking_status, smoking_date = data["smoking_status"]
+        row.update(
+            smoking_status=_no_info(smoking_status),
+            smoking_date=_no_info(smoking_date),
+        )
+
+    row["height_in"] = _number(data.get("height_inches"))
+    row["weight_lb"] = _number(data.get("weight"))
+    row["bmi"] = _number(data.get("bmi"))
+
+    return [row]
+
+
+def vital_rows(path, data):
+    """
+    Build the `vitals` rows for a parsed document.
+    """
+    columns = data.get("vitals_table")
+    if columns is None:
+        return []
+    names = list(TABLES["vitals"])[1:]
+    return [
+        dict(zip(names, values), path=path)
+        for values in zip(*(columns[name] for name in names))
+    ]
+
+
+def insurance_rows(path, data):
+    """
+    Build the `insurance` row for a parsed document (if it has insurance).
+    """
+    insurance = data.get("insurance", "no info")
+    if insurance == "no info":
+        return []
+
+    company, guarantor = insurance["company"], insurance["gurantor"]
+    return [
+        {
+            "path": path,
+            "company_name": _no_info(company["name"]),
+            "company_address": _no_info(company["addr"]),
+            "company_phone": _phone(company["telecom"]),
+            "guarantor_name": _no_info(guarantor["name"]),
+            "guarantor_address": _no_info(guarantor["addr"]),
+            "guarantor_phone": _phone(guarantor["telecom"]),
+            "subscriber_id": insurance["sub_id"],
+        }
+    ]
+
+
+def _result_rows(path, result):
+    """
+    Split a `batch.Result` into rows for each table. A document with failed
+    fields still gets the rows of the fields that worked.
+    """
+    if result.data is None:
+        error_row = dict.fromkeys(TABLES["patients"])
+        error_row.update(path=path, error=result.error)
+        return {"patients": [error_row], "vitals": [], "insurance": []}
+
+    return {
+        "patients": patient_rows(path, result.data, result.error),
+        "vitals": vital_rows(path, result.data),
+        "insurance": insurance_rows(path, result.data),
+    }
+
+
+def export(
+    sources,
+    out_dir,
+    fmt=None,
+    workers=None,
+    batch_size=1000,
+    db_path=codeDatabase.DB_PATH,
+):
+    """
+    Parse every CCDA in `sources` and write the `TABLES` to `out_dir`.
+
+    `fmt` is `"parquet"`, `"arrow"` or `"csv"`, defaulting to Parquet if pyarrow is
+    installed. Rows are written `batch_size` at a time. Returns the number of
+    documents exported.
+    """
+    if fmt is None:
+        fmt = "parquet" if _have_pyarrow() else "csv"
+
+    os.makedirs(out_dir, exist_ok=True)
+    writers = {}
+    for table, columns in TABLES.items():
+        path = os.path.join(out_dir, f"{table}.{EXTENSIONS[fmt]}")
+        if fmt == "csv":
+            writers[table] = CSVWriter(path, columns)
+        else:
+            writers[table] = ArrowWriter(path, columns, fmt)
+
+    pending = {table: [] for table in TABLES}
+    documents = 0
+
+    try:
+        results = batch.parse_many(
+            sources,
+            fields=FIELDS,
+            workers=workers,
+            ordered=False,
+            db_path=db_path,
+            partial=True,
+        )
+
+        for result in results:
+            documents += 1
+            for table, rows in _result_rows(result.path, result).items():
+                pending[table].extend(rows)
+                if len(pending[table]) >= batch_size:
+                    writers[table].write(pending[table])
+                    pending[table] = []
+
+        for table, rows in pending.items():
+            if rows:
+                writers[table].write(rows)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return documents
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument(
+        "sources", nargs="+", help="CCDA files, directories or archives"
+    )
+    arg_parser.add_argument("--out", required=True, help="output directory")
+    arg_parser.add_argument("--format", choices=list(EXTENSIONS), help="output format")
+    arg_parser.add_argument("--jobs", type=int, help="worker processes")
+    arg_parser.add_argument(
+        "--batch-size", type=int, default=1000, help="rows per row group"
+    )
+    arg_parser.add_argument("--db", default=codeDatabase.DB_PATH, help="code database")
+    args = arg_parser.parse_args(argv)
+
+    documents = export(
+        args.sources,
+        args.out,
+        fmt=args.format,
+        workers=args.jobs,
+        batch_size=args.batch_size,
+        db_path=args.db,
+    )
+    print(f"exported {documents} documents to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
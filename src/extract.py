@@ -0,0 +1,165 @@
+"""
+Declarative extraction from xmltodict (or `compactTree`) documents.
+
+A `Spec` is a set of named paths, written in a small subset of XPath::
+
+    entry/act/performer[templateId/@root='2.16.840.1.113883.10.20.22.4.87']/addr
+
+Each step is a child name (`@name` for attributes, `#text` for text), optionally
+followed by a predicate `[path='value']` (several can be joined with ` or `) or
+an index `[0]`. Paths are compiled once, and the paths of a spec are merged into
+a tree so each shared prefix is only walked once, however many fields use it.
+
+Missing children and xmltodict's dict-or-list shapes are dealt with here: every
+path yields a (possibly empty) list of matches.
+"""
+
+from collections.abc import Mapping
+import re
+
+_STEP = re.compile(r"([^\[\]/]+)(?:\[(.+)\])?")
+_CONDITION = re.compile(r"\s*(.+?)\s*=\s*(['\"])(.*)\2\s*")
+
+
+def _split(path):
+    """
+    Split a path into steps at the `/`s that aren't inside a predicate.
+    """
+    steps = []
+    start = depth = 0
+    quote = None
+    for i, char in enumerate(path):
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char == "[":
+            depth += 1
+        elif char == "]":
+            depth -= 1
+        elif char == "/" and depth == 0:
+            steps.append(path[start:i])
+            start = i + 1
+    steps.append(path[start:])
+    return steps
+
+
+def _children(nodes, name):
+    """
+    Get the `name` children of every node, flattening lists and skipping empties.
+    """
+    found = []
+    for node in nodes:
+        if not isinstance(node, Mapping):
+            continue
+        value = node.get(name)
+        if value is None:
+            continue
+        if isinstance(value, list):
+            found.extend(item for item in value if item is not None)
+        else:
+            found.append(value)
+    return found
+
+
+def _evaluate(steps, nodes):
+    for step in steps:
+        nodes = step(nodes)
+        if not nodes:
+            break
+    return nodes
+
+
+def compile_path(path):
+    """
+    Compile a path into a list of step functions, each taking and returning a
+    list of nodes.
+    """
+    return [compile_step(step) for step in _split(path)]
+
+
+def compile_step(step):
+    """
+    Compile one step of a path.
+    """
+    match = _STEP.fullmatch(step)
+    if match is None:
+        raise ValueError(f"invalid path step {step!r}")
+    name, predicate = match.groups()
+
+    if predicate is None:
+        return lambda nodes: _children(nodes, name)
+
+    if predicate.strip().isdigit():
+        index = int(predicate)
+        return lambda nodes: _children(nodes, name)[index : index + 1]
+
+    conditions = []
+    for condition in predicate.split(" or "):
+        match = _CONDITION.fullmatch(condition)
+        if match is None:
+            raise ValueError(f"invalid predicate {predicate!r}")
+        conditions.append((compile_path(match.group(1)), match.group(3)))
+
+    def matches(node):
+        return any(value in _evaluate(path, [node]) for path, value in conditions)
+
+    return lambda nodes: [node for node in _children(nodes, name) if matches(node)]
+
+
+def first(matches, default="no info"):
+    """
+    Get the first match, or `default` if there are none.
+    """
+    return matches[0] if matches else default
+
+
+class _Node:
+    """
+    A step in a `Spec`'s tree of paths.
+    """
+
+    __slots__ = ("step", "children", "fields")
+
+    def __init__(self, step):
+        self.step = step
+        self.children = {}
+        self.fields = []
+
+
+class Spec:
+    """
+    A set of named paths, evaluated together.
+    """
+
+    def __init__(self, paths):
+        self.paths = dict(paths)
+        self._root = _Node(None)
+
+        for field, path in self.paths.items():
+            node = self._root
+            for step in _split(path):
+                child = node.children.get(step)
+                if child is None:
+                    child = node.children[step] = _Node(compile_step(step))
+                node = child
+            node.fields.append(field)
+
+    def extract(self, node):
+        """
+        Evaluate every path against `node` in one walk.
+
+        Returns a dict of field name to the list of matches.
+        """
+        values = {field: [] for field in self.paths}
+        self._walk(self._root, [node], values)
+        return values
+
+    def _walk(self, tree, nodes, values):
+        for field in tree.fields:
+            values[field] = nodes
+        for child in tree.children.values():
+            matched = child.step(nodes)
+            if matched:
+                self._walk(child, matched, values)
@@ -1,13 +1,123 @@
-import openpyxl
-import sqlite3 as sqlite
+"""
+Load the CDC race and ethnicity code set into the code database.
 
-wb = openpyxl.load_workbook(r"Raw Data\CDC_REC.xlsx")
+Reads the "All Codes" sheet of `Raw Data/CDC_REC.xlsx` row by row (openpyxl's
+read-only mode, so the workbook is never loaded whole) and replaces the
+`cdc_rec` table of an existing database, indexed like every other code table,
+and registers its codesystem OID, all in one transaction. The `codeSnapshot` is
+rewritten afterwards.
 
-sheet = wb["All Codes"]
+Usage::
 
-codes = {}
+    python loadCDC_REC.py --db codeDatabase.db "Raw Data/CDC_REC.xlsx"
 
-for row in range(2, 968):
-    k = sheet.cell(row=row, column=1)
-    v = sheet.cell(row=row, column=3)
-    codes.update({k.value: v.value})
+`buildCodeDatabase.py --table cdc_rec=...` uses the same reader for full builds.
+"""
+
+import argparse
+import datetime
+import os
+import time
+
+import buildCodeDatabase
+import codeDatabase
+import codeSnapshot
+
+TABLE = "cdc_rec"
+SHEET = "All Codes"
+CDC_REC_PATH = os.path.join(buildCodeDatabase.RAW_DATA, "CDC_REC.xlsx")
+
+# header of the columns we read, and where they are if the header is missing
+CODE_COLUMN = ("Concept Code", 0)
+NAME_COLUMN = ("Concept Name", 2)
+
+
+def _column(header, column):
+    name, default = column
+    for i, value in enumerate(header):
+        if isinstance(value, str) and value.strip() == name:
+            return i
+    return default
+
+
+def read_cdc_rec(path=CDC_REC_PATH, sheet=SHEET):
+    """
+    Read `(code, description)` rows from the CDC race and ethnicity workbook.
+    """
+    import openpyxl
+
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb[sheet].iter_rows(values_only=True)
+        header = next(rows, ())
+        code_index = _column(header, CODE_COLUMN)
+        name_index = _column(header, NAME_COLUMN)
+
+        for row in rows:
+            if len(row) <= max(code_index, name_index):
+                continue
+            code, description = row[code_index], row[name_index]
+            if code is None or description is None:
+                continue
+            yield str(code).strip(), str(description).strip()
+    finally:
+        wb.close()
+
+
+def load(db_path=codeDatabase.DB_PATH, path=CDC_REC_PATH, sheet=SHEET):
+    """
+    Replace the `cdc_rec` table of the database at `db_path` with the codes in
+    the workbook at `path`. Returns the number of codes loaded.
+    """
+    db = codeDatabase.connect(db_path, read_only=False)
+    db.isolation_level = None
+    cur = db.cursor()
+
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        count = buildCodeDatabase.load_code_table(cur, TABLE, read_cdc_rec(path, sheet))
+
+        buildCodeDatabase.create_metadata_tables(cur)
+        oid = buildCodeDatabase.CODESYSTEMS[TABLE]
+        cur.execute("DELETE FROM codesystems WHERE codesystem_id = ?", (oid,))
+        cur.execute("INSERT INTO codesystems VALUES (?, ?)", (oid, TABLE))
+        cur.executemany(
+            "INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+            [
+                (f"source:{TABLE}", os.path.basename(path)),
+                (
+                    f"loaded_at:{TABLE}",
+                    datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                ),
+            ],
+        )
+        cur.execute("COMMIT")
+    except BaseException:
+        cur.execute("ROLLBACK")
+        db.close()
+        raise
+
+    cur.execute(f"ANALYZE {TABLE}")
+    db.close()
+
+    codeSnapshot.write(db_path)
+    return count
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--db", default=codeDatabase.DB_PATH, help="code database")
+    arg_parser.add_argument("--sheet", default=SHEET, help="worksheet with the codes")
+    arg_parser.add_argument(
+        "path", nargs="?", default=CDC_REC_PATH, help="CDC_REC.xlsx workbook"
+    )
+    args = arg_parser.parse_args(argv)
+
+    start = time.perf_counter()
+    count = load(args.db, args.path, args.sheet)
+    print(f"{TABLE}: {count} rows in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""
+Streaming loader for CCDA files.
+
+Builds the same nested dicts as `xmltodict.parse`, but only for the parts of the
+document that are actually used. The header (`recordTarget`) is read up front and
+the sections in `structuredBody` are loaded on demand.
+"""
+
+from collections.abc import Sequence
+import contextlib
+import io
+import xml.etree.ElementTree as ET
+
+import compactTree
+
+BODY_COMPONENT_DEPTH = 4  # ClinicalDocument/component/structuredBody/component
+SECTION_CHILD_DEPTH = 6  # .../component/section/<child>
+
+# the children a section can have before its `code`, in CDA's order
+BEFORE_SECTION_CODE = ("realmCode", "typeId", "templateId", "id")
+
+
+def _local(tag):
+    """
+    Strip the namespace from an ElementTree tag.
+    """
+    return tag.rsplit("}", 1)[-1]
+
+
+def _qualified(name, prefixes):
+    """
+    Turn an ElementTree `{uri}name` into the `prefix:name` form xmltodict uses.
+    """
+    if name[0] != "{":
+        return name
+
+    uri, local = name[1:].split("}", 1)
+    prefix = prefixes.get(uri, "")
+    if prefix:
+        return f"{prefix}:{local}"
+    return local
+
+
+def element_to_dict(elem, prefixes):
+    """
+    Convert an element into the value `xmltodict.parse` would have produced for it.
+
+    Attributes get an `@` prefix, repeated children become lists and text
+    alongside attributes or children is stored under `#text`. Namespace
+    declarations (`@xmlns`) are not kept.
+    """
+    result = {}
+    for key, value in elem.attrib.items():
+        result["@" + _qualified(key, prefixes)] = value
+
+    text = [elem.text or ""]
+    for child in elem:
+        name = _qualified(child.tag, prefixes)
+        value = element_to_dict(child, prefixes)
+        if name not in result:
+            result[name] = value
+        elif isinstance(result[name], list):
+            result[name].append(value)
+        else:
+            result[name] = [result[name], value]
+        text.append(child.tail or "")
+
+    text = "".join(text).strip()
+    if not result:
+        return text or None
+    if text:
+        result["#text"] = text
+    return result
+
+
+def _open(source):
+    """
+    Open a source for binary reading: a path, a bytes-like object, or a binary file
+    (including an `mmap`), which is rewound if it has been read and left open.
+    Files that can't seek, like archive members, are read from where they are.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if hasattr(source, "read"):
+        try:
+            position = source.tell()
+        except (AttributeError, OSError):  # a stream
+            position = 0
+        if position:
+            source.seek(0)
+        return contextlib.nullcontext(source)
+    return open(source, "rb")
+
+
+def _is_body_component(path):
+    """
+    Check whether `path` points at (or into) a `structuredBody` component.
+    """
+    return (
+        len(path) >= BODY_COMPONENT_DEPTH
+        and path[1] == "component"
+        and path[2] == "structuredBody"
+        and path[3] == "component"
+    )
+
+
+def _iterparse(source):
+    """
+    Walk a CCDA, yielding `(event, elem, path, prefixes)`.
+
+    `path` is the list of local tag names down to `elem`.
+    """
+    prefixes = {}
+    path = []
+    with _open(source) as ccda:
+        for event, elem in ET.iterparse(ccda, events=("start-ns", "start", "end")):
+            if event == "start-ns":
+                prefix, uri = elem
+                prefixes.setdefault(uri, prefix)
+                continue
+
+            if event == "start":
+                path.append(_local(elem.tag))
+                yield event, elem, path, prefixes
+            else:
+                yield event, elem, path, prefixes
+                path.pop()
+
+
+class SectionSummary:
+    """
+    The identifying parts of a section, kept after the rest of it is discarded.
+    """
+
+    def __init__(self):
+        self.code = None
+        self.template_ids = []
+        self.title = None
+
+
+class LazySections(Sequence):
+    """
+    The `structuredBody` components of a streamed CCDA.
+
+    Acts like the list xmltodict would have produced, but each component is only
+    parsed the first time it's indexed.
+    """
+
+    def __init__(self, source, summaries):
+        self._source = source
+        self.summaries = summaries
+        self._loaded = {}
+
+    @property
+    def codes(self):
+        """
+        The LOINC code of each section, in document order.
+        """
+        return [summary.code for summary in self.summaries]
+
+    def __len__(self):
+        return len(self.summaries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        index = range(len(self))[index]  # normalize, raises IndexError
+        if index not in self._loaded:
+            self.load([index])
+        return self._loaded[index]
+
+    def load(self, indexes):
+        """
+        Parse several components in a single pass over the file.
+        """
+        wanted = set(indexes) - set(self._loaded)
+        if wanted:
+            self._loaded.update(read_sections(self._source, wanted))
+
+
+def parse_streaming(source):
+    """
+    Read the header and a summary of each section from `source`.
+
+    `source` can be anything `_open` takes. Sections are read from it again when
+    they're loaded, so a file has to stay open until then.
+
+    Returns a dict shaped like the output of `xmltodict.parse`, with the body
+    components replaced by a `LazySections`.
+    """
+    root = None
+    header = None
+    summaries = []
+    summary = None
+
+    for event, elem, path, prefixes in _iterparse(source):
+        depth = len(path)
+
+        if event == "start":
+            if depth == 1:
+                root = _qualified(elem.tag, prefixes)
+            elif depth == BODY_COMPONENT_DEPTH and _is_body_component(path):
+                summary = SectionSummary()
+            continue
+
+        if depth == 2:
+            if path[1] == "recordTarget" and header is None:
+                header = element_to_dict(elem, prefixes)
+            elem.clear()
+
+        elif depth == BODY_COMPONENT_DEPTH and _is_body_component(path):
+            summaries.append(summary)
+            elem.clear()
+
+        elif depth == SECTION_CHILD_DEPTH and _is_body_component(path):
+            tag = path[-1]
+            if path[4] == "section":
+                if tag == "code":
+                    summary.code = elem.get("code")
+                elif tag == "templateId":
+                    summary.template_ids.append(elem.get("root"))
+                elif tag == "title":
+                    summary.title = "".join(elem.itertext()).strip()
+            elem.clear()
+
+    return {
+        root: {
+            "recordTarget": header,
+            "component": {
+                "structuredBody": {"component": LazySections(source, summaries)}
+            },
+        }
+    }
+
+
+def parse_compact(source):
+    """
+    Read all of `source` into a `compactTree.Document`, without building the
+    nested dicts. Returns its root `compactTree.Element`.
+    """
+    builder = compactTree.Builder()
+    prefixes = {}
+    names = {}  # ElementTree name -> xmltodict name
+
+    def qualified(name):
+        result = names.get(name)
+        if result is None:
+            result = names[name] = _qualified(name, prefixes)
+        return result
+
+    with _open(source) as ccda:
+        for event, elem in ET.iterparse(ccda, events=("start-ns", "start", "end")):
+            if event == "start-ns":
+                prefix, uri = elem
+                prefixes.setdefault(uri, prefix)
+            elif event == "start":
+                builder.start(
+                    qualified(elem.tag),
+                    [(qualified(key), value) for key, value in elem.attrib.items()],
+                )
+            else:
+                text = [elem.text or ""]
+                text.extend(child.tail or "" for child in elem)
+                builder.end("".join(text).strip())
+                tail = elem.tail  # may have been read already, the parent needs it
+                elem.clear()
+                elem.tail = tail
+    return builder.finish()
+
+
+def _matches(group, code, template_ids):
+    return code in group or any(template_id in group for template_id in template_ids)
+
+
+def parse_sections(source, wanted=None, skip_text=False):
+    """
+    Read the header and the sections matching `wanted` in one pass, skipping over
+    every other section.
+
+    `wanted` is a list of sets of section codes and templateIds. A section is kept
+    if its code or one of its templateIds is in any of the sets, and reading stops
+    as soon as every set has matched a section (so only the first of two sections
+    with the same code is guaranteed). `None` keeps every section. With
+    `skip_text`, the sections' narrative `<text>` is dropped too.
+
+    Returns a dict shaped like the output of `xmltodict.parse`, with the kept
+    components in a list.
+    """
+    root = None
+    header = None
+    components = []
+    remaining = None if wanted is None else list(wanted)
+    section = None
+    code = None
+    template_ids = []
+    decided = keep = False
+
+    for event, elem, path, prefixes in _iterparse(source):
+        depth = len(path)
+
+        if event == "start":
+            if depth == 1:
+                root = _qualified(elem.tag, prefixes)
+            elif depth == BODY_COMPONENT_DEPTH and _is_body_component(path):
+                code = None
+                template_ids = []
+                decided = keep = wanted is None
+            elif depth == BODY_COMPONENT_DEPTH + 1 and path[-1] == "section":
+                section = elem
+            continue
+
+        if depth == 2:
+            if path[1] == "recordTarget" and header is None:
+                header = element_to_dict(elem, prefixes)
+            elem.clear()
+
+        elif depth == BODY_COMPONENT_DEPTH and _is_body_component(path):
+            if keep:
+                components.append(element_to_dict(elem, prefixes))
+                if remaining is not None:
+                    remaining = [
+                        group
+                        for group in remaining
+                        if not _matches(group, code, template_ids)
+                    ]
+            elem.clear()
+
+        elif depth == SECTION_CHILD_DEPTH and _is_body_component(path):
+            tag = path[-1]
+            if path[4] == "section" and not decided:
+                if tag == "templateId":
+                    template_ids.append(elem.get("root"))
+                elif tag == "code":
+                    code = elem.get("code")
+                if tag not in BEFORE_SECTION_CODE:  # the code, or past where it'd be
+                    decided = True
+                    keep = any(_matches(group, code, template_ids) for group in wanted)
+
+            if decided and not keep:
+                elem.clear()
+            elif skip_text and tag == "text" and path[4] == "section":
+                section.remove(elem)
+
+        if header is not None and remaining is not None and not remaining:
+            break
+
+    return {
+        root: {
+            "recordTarget": header,
+            "component": {"structuredBody": {"component": components}},
+        }
+    }
+
+
+def read_sections(source, indexes):
+    """
+    Parse the body components at `indexes`, skipping over everything else.
+
+    Stops reading as soon as every requested component has been found.
+    Returns a dict of index to component.
+    """
+    wanted = set(indexes)
+    found = {}
+    index = -1
+    keep = False
+
+    for event, elem, path, prefixes in _iterparse(source):
+        depth = len(path)
+
+        if event == "start":
+            if depth == BODY_COMPONENT_DEPTH and _is_body_component(path):
+                index += 1
+                keep = index in wanted
+            continue
+
+        if depth == 2:
+            elem.clear()
+
+        elif depth == BODY_COMPONENT_DEPTH and _is_body_component(path):
+            if keep:
+                found[index] = element_to_dict(elem, prefixes)
+                if len(found) == len(wanted):
+                    break
+            elem.clear()
+
+        elif depth == SECTION_CHILD_DEPTH and not keep and _is_body_component(path):
+            elem.clear()
+
+    return found
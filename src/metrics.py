@@ -0,0 +1,191 @@
+"""
+Timings and counters for `Parser`.
+
+Pass a `Metrics` to `Parser` (or any of its constructors) as `metrics` to record
+where the time goes. One `Metrics` can be shared by many parsers to add them up.
+
+Stages (seconds, number of times and longest time):
+
+- `read`: reading the file into memory
+- `parse`: parsing the XML (including reading it, for streaming and partial
+  parses, and loading sections on demand when streaming)
+- `cache`: loading the document through a `parseCache` (parsing it on a miss)
+- `setup`: finding the patient and indexing the sections
+- `db_query`: SQLite queries for codes and codesystems
+- `units`: unit conversions, including building the pint `UnitRegistry` the
+  first time one is needed (counted in `unit_registry_builds`)
+
+Counters: `bytes_parsed`, `db_queries`, `cache_hits`, `cache_misses` and
+`unit_registry_builds`. With `allocations=True`, the memory allocated during
+each stage is also recorded, using `tracemalloc` (which slows everything down).
+
+Without `metrics`, the parser only checks it against `None` at each hook.
+"""
+
+from contextlib import contextmanager, nullcontext
+import time
+import tracemalloc
+
+_NULL_STAGE = nullcontext()
+
+# counter -> help text for `to_prometheus`
+COUNTERS = {
+    "bytes_parsed": "Bytes of XML parsed.",
+    "db_queries": "SQLite queries run.",
+    "cache_hits": "Code lookups answered from codeCache.",
+    "cache_misses": "Code lookups that went to the database.",
+    "unit_registry_builds": "Times the pint UnitRegistry was built.",
+}
+
+
+def stage(metrics, name):
+    """
+    `metrics.stage(name)`, or a context manager that does nothing if `metrics`
+    is `None`.
+    """
+    if metrics is None:
+        return _NULL_STAGE
+    return metrics.stage(name)
+
+
+class Metrics:
+    """
+    Per-stage timings and counters for one or more parsers.
+
+    `callback`, if given, is called as `callback(stage, seconds)` whenever a stage
+    finishes.
+    """
+
+    def __init__(self, callback=None, allocations=False):
+        self.callback = callback
+        self.allocations = allocations
+        self.timings = {}  # stage -> [count, seconds, max seconds]
+        self.counters = {}
+        self.allocated = {}  # stage -> bytes
+        if allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time the code in a `with` block as stage `name`.
+        """
+        if self.allocations:
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+            if self.allocations:
+                allocated = tracemalloc.get_traced_memory()[0] - before
+                self.allocated[name] = self.allocated.get(name, 0) + max(allocated, 0)
+
+    def record(self, name, seconds):
+        """
+        Add one run of stage `name` that took `seconds`.
+        """
+        timing = self.timings.get(name)
+        if timing is None:
+            self.timings[name] = [1, seconds, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+            if seconds > timing[2]:
+                timing[2] = seconds
+        if self.callback is not None:
+            self.callback(name, seconds)
+
+    def count(self, name, n=1):
+        """
+        Add `n` to counter `name`.
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def totals(self):
+        """
+        Get the total seconds spent in each stage.
+        """
+        return {name: timing[1] for name, timing in self.timings.items()}
+
+    def merge(self, other):
+        """
+        Add the timings and counters of another `Metrics` to this one.
+        """
+        for name, (count, seconds, longest) in other.timings.items():
+            timing = self.timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += count
+            timing[1] += seconds
+            timing[2] = max(timing[2], longest)
+        for name, n in other.counters.items():
+            self.count(name, n)
+        for name, n in other.allocated.items():
+            self.allocated[name] = self.allocated.get(name, 0) + n
+
+    def reset(self):
+        """
+        Clear every timing and counter.
+        """
+        self.timings.clear()
+        self.counters.clear()
+        self.allocated.clear()
+
+    def as_dict(self):
+        """
+        Get everything recorded as a dict (JSON serializable).
+        """
+        out = {
+            "stages": {
+                name: {"count": count, "seconds": seconds, "max_seconds": longest}
+                for name, (count, seconds, longest) in self.timings.items()
+            },
+            "counters": dict(self.counters),
+        }
+        if self.allocations:
+            out["allocated_bytes"] = dict(self.allocated)
+        return out
+
+    def to_prometheus(self, prefix="ccda_parser"):
+        """
+        Get everything recorded in the Prometheus text exposition format.
+        """
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            if not samples:
+                return
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{prefix}_{name}{labels} {value}")
+
+        stages = sorted(self.timings.items())
+        metric(
+            "stage_seconds_total",
+            "counter",
+            "Seconds spent in each parser stage.",
+            [(f'{{stage="{name}"}}', timing[1]) for name, timing in stages],
+        )
+        metric(
+            "stage_runs_total",
+            "counter",
+            "Number of times each parser stage ran.",
+            [(f'{{stage="{name}"}}', timing[0]) for name, timing in stages],
+        )
+        metric(
+            "stage_seconds_max",
+            "gauge",
+            "Longest single run of each parser stage.",
+            [(f'{{stage="{name}"}}', timing[2]) for name, timing in stages],
+        )
+        for name, value in sorted(self.counters.items()):
+            help_text = COUNTERS.get(name, f"Parser counter {name}.")
+            metric(f"{name}_total", "counter", help_text, [("", value)])
+        metric(
+            "stage_allocated_bytes_total",
+            "counter",
+            "Bytes allocated in each parser stage.",
+            [(f'{{stage="{name}"}}', n) for name, n in sorted(self.allocated.items())],
+        )
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,279 @@
+"""
+An on-disk cache of parsed CCDAs, shared by every process that uses it.
+
+Two kinds of entries are kept, both keyed by a hash of the document's bytes:
+
+- documents: the parsed (and, with `fields`/`sections`, pruned) document dict,
+  so `Parser(path, cache=...)` skips parsing the XML
+- records: the values of a list of fields, so `batch.parse_many(cache=...)`
+  skips the parser and the code database entirely
+
+Keys also include `parser.PARSER_VERSION` and the options, and records include
+the code database's `metadata`, so a new parser or terminology release never
+serves stale values. Entries are pickled and compressed into a SQLite file, and
+the least recently used ones are evicted once it's over `max_bytes` (their total
+size is kept up to date by triggers, so checking it doesn't read every entry)::
+
+    cache = parseCache.ParseCache("parseCache.db")
+    patient = parser.Parser("CCDAs/Sample CCDA.xml", fields=["height"], cache=cache)
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import sqlite3 as sqlite
+import threading
+import time
+import zlib
+
+import codeDatabase
+import parser
+
+CACHE_PATH = "parseCache.db"
+MAX_BYTES = 256 * 1024 * 1024
+
+# how stale an entry's last use has to be before a hit updates it, in seconds
+TOUCH_INTERVAL = 60
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class ParseCache:
+    """
+    A size-bounded, least-recently-used cache of documents and records.
+
+    Connections are per thread and reopened after a fork, so one `ParseCache` can
+    be shared by threads and worker processes.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._pid = os.getpid()
+
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")  # one process sets up the file
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+                ) WITHOUT ROWID;"""
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_last_used"
+                " ON entries (last_used, size)"
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS total (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                size INTEGER NOT NULL
+                );"""
+            )
+            # caches made before there was a total start from their entries
+            conn.execute(
+                "INSERT OR IGNORE INTO total SELECT 0, coalesce(sum(size), 0) FROM entries"
+            )
+            conn.execute(
+                """CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries
+                BEGIN UPDATE total SET size = size + new.size; END;"""
+            )
+            conn.execute(
+                """CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries
+                BEGIN UPDATE total SET size = size - old.size; END;"""
+            )
+            conn.execute(
+                """CREATE TRIGGER IF NOT EXISTS entries_update
+                AFTER UPDATE OF size ON entries
+                BEGIN UPDATE total SET size = size - old.size + new.size; END;"""
+            )
+
+    def _connect(self):
+        if self._pid != os.getpid():  # forked, don't use the parent's connection
+            self._local = threading.local()
+            self._pid = os.getpid()
+
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode = WAL")  # readers don't block writers
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def __reduce__(self):  # sent to a worker, use its shared cache for the same file
+        return get_cache, (self.path, self.max_bytes)
+
+    def terminology_version(self, db_path=codeDatabase.DB_PATH):
+        """
+        Get the `codeDatabase.version` of the code database at `db_path`, checked
+        every time so records made before an update are never used after it.
+        """
+        return codeDatabase.get_provider(db_path).version()
+
+    def key(self, data, kind, **options):
+        """
+        Make the key for an entry of `kind` about the document `data` (its bytes).
+        `options` are whatever else the entry depends on.
+        """
+        options = json.dumps(options, sort_keys=True, default=list).encode()
+        return f"{kind}:{parser.PARSER_VERSION}:{_hash(data)}:{_hash(options)}"
+
+    def get(self, key):
+        """
+        Get a cached value, or `None` if there isn't one.
+        """
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT value, last_used FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        now = time.time()
+        if now - row[1] > TOUCH_INTERVAL:
+            with conn:
+                conn.execute(
+                    "UPDATE entries SET last_used = ? WHERE key = ?", (now, key)
+                )
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def put(self, key, value):
+        """
+        Cache a value, evicting the least recently used entries if the cache is
+        over `max_bytes`.
+        """
+        blob = zlib.compress(pickle.dumps(value, pickle.HIGHEST_PROTOCOL), 1)
+        conn = self._connect()
+        with conn:
+            # an upsert, since REPLACE's delete wouldn't run the delete trigger
+            conn.execute(
+                """INSERT INTO entries VALUES (?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                value = excluded.value,
+                size = excluded.size,
+                last_used = excluded.last_used""",
+                (key, blob, len(blob), time.time()),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT size FROM total").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        target = total - self.max_bytes * 0.9  # make some room, not just enough
+        freed = 0
+        keys = []
+        for key, size in conn.execute(
+            "SELECT key, size FROM entries ORDER BY last_used"
+        ):
+            keys.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        conn.executemany("DELETE FROM entries WHERE key = ?", keys)
+
+    def load_document(
+        self, source, sections=None, fields=None, skip_text=False, compact=False
+    ):
+        """
+        Get the document dict for `source` (a path or the document's bytes),
+        parsing it with `parser.load_document` if it isn't cached.
+        """
+        data = source if isinstance(source, bytes) else _read_bytes(source)
+        key = self.key(
+            data,
+            "document",
+            sections=sections,
+            fields=fields,
+            skip_text=skip_text,
+            compact=compact,
+        )
+
+        ccda_data = self.get(key)
+        if ccda_data is None:
+            ccda_data = parser.load_document(
+                data,
+                sections=sections,
+                fields=fields,
+                skip_text=skip_text,
+                compact=compact,
+            )
+            self.put(key, ccda_data)
+        return ccda_data
+
+    def record_key(self, data, fields, db_path=codeDatabase.DB_PATH):
+        """
+        Make the key for the values of `fields` in the document `data`.
+        """
+        return self.key(
+            data,
+            "record",
+            fields=list(fields),
+            terminology=self.terminology_version(db_path),
+        )
+
+    def clear(self):
+        """
+        Delete every entry.
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM entries")
+        conn.execute("VACUUM")
+
+    def stats(self):
+        """
+        Get the number of entries, their size and this object's hit counts.
+        """
+        count, size = (
+            self._connect()
+            .execute("SELECT count(*), (SELECT size FROM total) FROM entries")
+            .fetchone()
+        )
+        return {
+            "entries": count,
+            "bytes": int(size),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def close(self):
+        """
+        Close this thread's connection.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def get_cache(path=CACHE_PATH, max_bytes=MAX_BYTES):
+    """
+    Get the shared `ParseCache` for `path` in this process.
+    """
+    key = os.path.abspath(path)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = _caches[key] = ParseCache(path, max_bytes)
+    return cache
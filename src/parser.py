@@ -4,33 +4,424 @@ CCDA Parser
 By Garron Anderson"""
 
 from collections import namedtuple
+from collections.abc import Mapping
 import datetime
-import sqlite3 as sqlite
+from functools import cached_property
+import mmap
+import os
+import time
 
 import xmltodict
 
-import iso639
-from pint import UnitRegistry
+import codeCache
+import codeData
+import codeDatabase
+import codeSnapshot
+import codeTelemetry
+import compactTree
+import extract
+import loader
+import metrics as parser_metrics
+import units
+import vitals
+
+# bump when what the parser loads or returns changes, to invalidate `parseCache`
+PARSER_VERSION = 1
+
+Height = namedtuple("Height", "feet inches")
+Demographics = namedtuple(
+    "Demographics",
+    "name gender dob race ethnicity languages preferences address phone phone_type",
+)
+
+
+# sections each patient property needs; `HEADER_FIELDS` need none
+FIELD_SECTIONS = {
+    "height": ("vital signs",),
+    "height_inches": ("vital signs",),
+    "weight": ("vital signs",),
+    "bmi": ("vital signs",),
+    "vitals_table": ("vital signs",),
+    "latest_vitals": ("vital signs",),
+    "smoking_status": ("social history",),
+    "insurance": ("payment sources",),
+}
+HEADER_FIELDS = {
+    "name",
+    "gender",
+    "dob",
+    "race_ethnicity",
+    "languages",
+    "address",
+    "phone",
+    "demographics",
+}
+# everything `fields` (and `batch.parse_many`) can ask for
+FIELDS = HEADER_FIELDS | FIELD_SECTIONS.keys()
+
+
+# paths of the header values, from patientRole
+HEADER_SPEC = extract.Spec(
+    {
+        "name": "patient/name",
+        "gender": "patient/administrativeGenderCode",
+        "birth_time": "patient/birthTime/@value",
+        "race": "patient/raceCode",
+        "ethnicity": "patient/ethnicGroupCode",
+        "languages": "patient/languageCommunication",
+        "addr": "addr",
+        "telecom": "telecom",
+    }
+)
+
+SOCIAL_HISTORY = "2.16.840.1.113883.10.20.22.2.17"
+PAYERS = "2.16.840.1.113883.10.20.22.2.18"
+
+_POLICY = "entry/act/entryRelationship/act"
+_COMPANY = f"{_POLICY}/performer[templateId/@root='2.16.840.1.113883.10.20.22.4.87']"
+_GUARANTOR = f"{_POLICY}/performer[templateId/@root='2.16.840.1.113883.10.20.22.4.88']"
+_SUBSCRIBER = (
+    f"{_POLICY}/participant[templateId/@root='2.16.840.1.113883.10.20.22.4.90']"
+)
+
+# paths of the values read from sections, by section templateId
+SECTION_SPECS = {
+    SOCIAL_HISTORY: extract.Spec(
+        {"smoking": "entry/observation[code/@code='72166-2' or code/@code='ASSERTION']"}
+    ),
+    PAYERS: extract.Spec(
+        {
+            "company": _COMPANY,
+            "company_name": f"{_COMPANY}/assignedEntity/representedOrganization/name",
+            "company_addr": f"{_COMPANY}/assignedEntity/representedOrganization/addr",
+            "company_telecom": (
+                f"{_COMPANY}/assignedEntity/representedOrganization/telecom"
+            ),
+            "guarantor": _GUARANTOR,
+            "guarantor_name": f"{_GUARANTOR}/assignedEntity/assignedPerson/name",
+            "guarantor_addr": f"{_GUARANTOR}/assignedEntity/addr",
+            "guarantor_telecom": f"{_GUARANTOR}/assignedEntity/telecom",
+            "subscriber": _SUBSCRIBER,
+            "subscriber_id": f"{_SUBSCRIBER}/participantRole/id/@extension",
+        }
+    ),
+}
+
+# paths within a smoking status observation
+SMOKING_SPEC = extract.Spec(
+    {
+        "value": "value",
+        "low": "effectiveTime/low/@value",
+        "time": "effectiveTime/@value",
+    }
+)
 
 
 class ParserException(Exception):
     """A class for when the parser raises an exception."""
 
 
+def _section_group(name):
+    """
+    Get the section codes and templateIds that count as section `name` (a title
+    from `codeData.section_codes`, a LOINC code or a templateId).
+    """
+    group = set(codeData.section_codes.get(name.lower(), (name,)))
+    group.update(
+        template_id
+        for template_id, code in codeData.section_template_ids.items()
+        if code in group
+    )
+    return group
+
+
+def _wanted_sections(sections, fields):
+    """
+    Turn the `sections` and `fields` options into a list of section groups for
+    `loader.parse_sections`, or `None` to read every section.
+    """
+    if sections is None and fields is None:
+        return None
+
+    names = list(sections or [])
+    for field in fields or []:
+        if field in FIELD_SECTIONS:
+            names.extend(FIELD_SECTIONS[field])
+        elif field not in HEADER_FIELDS:  # don't know what it needs
+            return None
+    return [_section_group(name) for name in dict.fromkeys(names)]
+
+
+def _source_size(source):
+    """
+    The size in bytes of a document `load_document` can parse, or `None` if it
+    can't be told without reading it.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        return len(source)
+    try:
+        return os.fstat(source.fileno()).st_size
+    except (AttributeError, OSError, ValueError):
+        return None
+
+
+def _parse_compact(source, wanted, skip_text):
+    """
+    Parse `source` into a `compactTree` document, keeping the sections in `wanted`
+    (see `loader.parse_sections`).
+    """
+    if wanted is None and not skip_text:
+        return loader.parse_compact(source)
+    return compactTree.from_dict(loader.parse_sections(source, wanted, skip_text))
+
+
+def load_document(
+    source,
+    streaming=False,
+    sections=None,
+    fields=None,
+    skip_text=False,
+    metrics=None,
+    compact=False,
+):
+    """
+    Parse `source` (a path or anything else `loader` can open) into the document
+    dict. The options are as for `Parser`.
+    """
+    if metrics is not None:
+        size = _source_size(source)
+        if size is not None:
+            metrics.count("bytes_parsed", size)
+
+    wanted = _wanted_sections(sections, fields)
+    if compact:
+        with parser_metrics.stage(metrics, "parse"):
+            return _parse_compact(source, wanted, skip_text)
+    if wanted is not None or skip_text:
+        with parser_metrics.stage(metrics, "parse"):
+            return loader.parse_sections(source, wanted, skip_text)
+    if streaming:
+        with parser_metrics.stage(metrics, "parse"):
+            return loader.parse_streaming(source)
+    if isinstance(source, (str, os.PathLike)):
+        with parser_metrics.stage(metrics, "read"):
+            with open(source, "rb") as ccda:  # load file, parse the bytes
+                source = ccda.read()
+    with parser_metrics.stage(metrics, "parse"):
+        return xmltodict.parse(source)
+
+
 class Parser:
     """The main class that handles the parsing of CCDA files.
 
     Generates name, address, etc."""
 
-    def __init__(self, filename):
+    def __init__(
+        self,
+        filename,
+        streaming=False,
+        db_conn=None,
+        db_path=codeDatabase.DB_PATH,
+        sections=None,
+        fields=None,
+        skip_text=False,
+        metrics=None,
+        cache=None,
+        compact=False,
+    ):
         """
         Start up parser given a filename.
+
+        With `streaming=True`, only the header is parsed up front and each section is
+        read from the file the first time it's asked for (see `loader`).
+
+        `sections` (titles from `codeData.section_codes`, LOINC codes or templateIds)
+        and `fields` (patient properties, see `FIELD_SECTIONS`) limit the parse to the
+        sections they need: the rest are skipped and reading stops once they've all
+        been found. `skip_text` leaves out the sections' narrative `<text>`. Either
+        one takes the place of `streaming`.
+
+        The code database at `db_path` is used through a pooled connection shared by
+        every parser on the same thread, unless a connection is passed as `db_conn`.
+        The pooled connection is only opened when a code has to be looked up, so the
+        header fields that don't need codes (`name`, `dob`, ...) work without a
+        database. Either way the parser doesn't own the connection, and `close`
+        leaves it open.
+
+        `metrics` is a `metrics.Metrics` to record timings and counts in.
+
+        With `compact=True`, the document is kept as a `compactTree` instead of
+        nested dicts, which takes a fraction of the memory (`streaming` is ignored).
+
+        With a `parseCache.ParseCache` as `cache`, the parsed document is taken from
+        the cache if the file hasn't changed, and saved to it otherwise (`streaming`
+        is ignored).
         """
         self._filename = filename
-        with open(self._filename, encoding="utf8") as ccda:  # load file
-            ccda_text = ccda.read()
-            self.ccda_data = xmltodict.parse(ccda_text)
+        if cache is not None:
+            with parser_metrics.stage(metrics, "cache"):
+                ccda_data = cache.load_document(
+                    filename, sections, fields, skip_text, compact
+                )
+        else:
+            ccda_data = load_document(
+                filename, streaming, sections, fields, skip_text, metrics, compact
+            )
+        self._setup(ccda_data, db_conn, db_path, metrics)
+
+    @classmethod
+    def from_bytes(
+        cls,
+        data,
+        streaming=False,
+        db_conn=None,
+        db_path=codeDatabase.DB_PATH,
+        sections=None,
+        fields=None,
+        skip_text=False,
+        metrics=None,
+        compact=False,
+    ):
+        """
+        Start up parser given the document as `bytes` (or a `bytearray` or
+        `memoryview`), parsing straight from the buffer. Options are as for `Parser`.
+        """
+        ccda_data = load_document(
+            data, streaming, sections, fields, skip_text, metrics, compact
+        )
+        return cls.from_dict(ccda_data, db_conn, db_path, metrics)
+
+    @classmethod
+    def from_file(
+        cls,
+        file,
+        streaming=False,
+        db_conn=None,
+        db_path=codeDatabase.DB_PATH,
+        sections=None,
+        fields=None,
+        skip_text=False,
+        metrics=None,
+        compact=False,
+    ):
+        """
+        Start up parser given a binary file object, which is read in chunks. Options
+        are as for `Parser`.
+
+        With `streaming=True`, the file has to be seekable and stay open while the
+        parser is used, since sections are read from it when they're needed.
+        """
+        ccda_data = load_document(
+            file, streaming, sections, fields, skip_text, metrics, compact
+        )
+        return cls.from_dict(ccda_data, db_conn, db_path, metrics)
+
+    @classmethod
+    def from_mmap(
+        cls,
+        filename,
+        streaming=False,
+        db_conn=None,
+        db_path=codeDatabase.DB_PATH,
+        sections=None,
+        fields=None,
+        skip_text=False,
+        metrics=None,
+        compact=False,
+    ):
+        """
+        Start up parser given a filename, parsing from a memory map of the file
+        instead of reading it into memory. Options are as for `Parser`.
 
+        With `streaming=True`, the map stays open for loading sections until `close`.
+        """
+        with open(filename, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if metrics is not None:
+            metrics.count("bytes_parsed", len(mapped))
+
+        wanted = _wanted_sections(sections, fields)
+        keep_open = streaming and wanted is None and not skip_text and not compact
+        try:
+            with parser_metrics.stage(metrics, "parse"):
+                if compact:
+                    ccda_data = _parse_compact(mapped, wanted, skip_text)
+                elif keep_open:
+                    ccda_data = loader.parse_streaming(mapped)
+                elif wanted is not None or skip_text:
+                    ccda_data = loader.parse_sections(mapped, wanted, skip_text)
+                else:
+                    with memoryview(mapped) as view:
+                        ccda_data = xmltodict.parse(view)
+        finally:
+            if not keep_open:
+                mapped.close()
+
+        self = cls.from_dict(ccda_data, db_conn, db_path, metrics)
+        self._filename = filename
+        if keep_open:
+            self._mmap = mapped
+        return self
+
+    @classmethod
+    def from_dict(
+        cls, ccda_data, db_conn=None, db_path=codeDatabase.DB_PATH, metrics=None
+    ):
+        """
+        Start up parser given a document that's already been parsed, by xmltodict,
+        `loader.parse_streaming` or `loader.parse_compact`.
+        """
+        self = cls.__new__(cls)
+        self._filename = None
+        self._setup(ccda_data, db_conn, db_path, metrics)
+        return self
+
+    def _setup(self, ccda_data, db_conn, db_path, metrics=None):
+        """
+        Find the patient and sections in `ccda_data`. The code database is connected
+        to when it's first needed (see `db_conn`).
+        """
+        self.metrics = metrics
+        with parser_metrics.stage(metrics, "setup"):
+            self._setup_document(ccda_data)
+
+        self._db_path = db_path
+        self._db_conn = db_conn
+        self._db_cursor = None
+        self._pooled = db_conn is None
+        self._database = None
+
+        self.height_factory = Height
+
+    @property
+    def db_conn(self):
+        """
+        The code database connection, taken from the pool the first time it's used
+        (and `None` once the parser is closed).
+        """
+        if self._db_conn is None and self._db_path is not None:
+            self._db_conn = codeDatabase.get_provider(self._db_path).connection()
+        return self._db_conn
+
+    @property
+    def db_cursor(self):
+        """
+        A cursor on `db_conn`, opened the first time it's used.
+        """
+        if self._db_cursor is None and self.db_conn is not None:
+            self._db_cursor = self.db_conn.cursor()
+        return self._db_cursor
+
+    def _setup_document(self, ccda_data):
+        """
+        Find the patient and index the sections of `ccda_data`.
+        """
+        self.ccda_data = ccda_data
+        self._mmap = None
+        self._section_values = {}
         self.patientRole = self.ccda_data["ClinicalDocument"]["recordTarget"][
             "patientRole"
         ]
@@ -39,22 +430,106 @@ class Parser:
         self.components = self.ccda_data["ClinicalDocument"]["component"][
             "structuredBody"
         ]["component"]
-        self.component_list = []
-        for i in range(len(self.components)):
-            self.component_list.append(self.components[i]["section"]["code"]["@code"])
+        if isinstance(self.components, Mapping):  # only one component
+            self.components = [self.components]
+        self._index_sections()
 
-        # connect to db
-        self.db_conn = sqlite.connect("codeDatabase.db")
-        self.db_cursor = self.db_conn.cursor()
+    @property
+    def ucum_registry(self):
+        """
+        The pint `UnitRegistry` (see `units`), shared by every parser in the process.
+        """
+        return units.get_registry()
 
-        self.ucum_registry = UnitRegistry(system="UCUM")
+    def close(self):
+        """
+        Release the database cursor and the parsed document.
+        """
+        if self._db_cursor is not None:
+            self._db_cursor.close()
+        self._db_cursor = self._db_conn = self._db_path = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self.ccda_data = self.patientRole = self.patient = self.components = None
+
+    def invalidate(self, *names):
+        """
+        Forget the saved values of the patient properties in `names` (or all of
+        them), so they're worked out again on next access.
+        """
+        if not names:
+            names = [
+                name
+                for name, attr in vars(type(self)).items()
+                if isinstance(attr, cached_property)
+            ]
+        for name in names:
+            self.__dict__.pop(name, None)
 
-        self.height_factory = namedtuple("Height", "feet inches")
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     # INTERNAL FUNCTIONS
 
-    def _connect_db(self):
-        return sqlite.connect("codeDatabase.db")
+    def _database_key(self):
+        """
+        The key of the code database in `codeCache`, worked out the first time the
+        caches are used. A database that's been updated since it was cached gets a
+        new key, and the entries for the old one are dropped.
+        """
+        if self._database is None:
+            if self._pooled:  # only rereads the metadata if the file has changed
+                version = codeDatabase.get_provider(self._db_path).version()
+            else:
+                version = codeDatabase.version(self.db_conn)
+            self._database = codeCache.database_key(self._db_path, version)
+            codeSnapshot.install(self._db_path, self.db_conn, self._database)
+        return self._database
+
+    def _index_sections(self):
+        """
+        Build the lookups from section code and templateId to component index.
+
+        Sections are also indexed under the code their templateIds imply, in case
+        the document uses an unusual code.
+        """
+        if isinstance(self.components, loader.LazySections):
+            # use the summaries so we don't load every section
+            sections = [
+                (summary.code, summary.template_ids)
+                for summary in self.components.summaries
+            ]
+        else:
+            sections = []
+            for component in self.components:
+                section = component["section"]
+                template_ids = section.get("templateId", [])
+                if isinstance(template_ids, Mapping):
+                    template_ids = [template_ids]
+                sections.append(
+                    (
+                        section["code"]["@code"],
+                        [template_id.get("@root") for template_id in template_ids],
+                    )
+                )
+
+        self.component_list = [code for code, _ in sections]
+        self._section_index = {}
+        self._template_index = {}
+        for i, (code, template_ids) in enumerate(sections):
+            self._section_index.setdefault(code, i)
+            for template_id in template_ids:
+                self._template_index.setdefault(template_id, i)
+
+        for i, (_, template_ids) in enumerate(sections):
+            for template_id in template_ids:
+                code = codeData.section_template_ids.get(template_id)
+                if code is not None:
+                    self._section_index.setdefault(code, i)
 
     def lookup_code(self, code, codesystem):
         """
@@ -63,37 +538,145 @@ class Parser:
         To perform a reverse lookup, prefix 'codesystem' with 'reverse_'.
 
         Will return 'no info' if no code provided.
+
+        Results are kept in the shared `codeCache.codes` cache, and codes that
+        aren't in the database in `codeCache.missing`.
         """
         if code is None:
             return "no info"
 
+        metrics = self.metrics
+        cache_key = (self._database_key(), codesystem, code)
+        cached = codeCache.codes.get(cache_key)
+        if cached is None and codeCache.missing.get(cache_key):
+            cached = ""
+            if codeTelemetry.recorder is not None:
+                codeTelemetry.recorder.record_missing(codesystem, code)
+        if cached is not None:
+            if metrics is not None:
+                metrics.count("cache_hits")
+            return cached
+
+        if metrics is not None:
+            metrics.count("cache_misses")
+
         query_params = {"code": code}
 
         if codesystem.startswith("reverse_"):
-            codesystem = codesystem[8:]
-            out = self.db_cursor.execute(
-                f"SELECT code FROM {codesystem} WHERE description = :code", query_params
+            table = codesystem[8:]
+            out = self._query(
+                table,
+                f"SELECT code FROM {table} WHERE description = :code",
+                query_params,
             )
         else:
-            out = self.db_cursor.execute(
-                f"SELECT description FROM {codesystem} WHERE code = :code", query_params
+            table = codesystem
+            out = self._query(
+                table,
+                f"SELECT description FROM {table} WHERE code = :code",
+                query_params,
             )
 
-        out = list(out)
         try:
-            return out[0][0]
+            result = out[0][0]
         except IndexError:
+            self._record_missing(cache_key, table, code)
             return ""
 
-    def get_data(self, obj, field="@code", codesystem=None):
+        codeCache.codes.put(cache_key, result)
+        return result
+
+    def lookup_codes(self, requests):
         """
-        Get the data from an object with a field.
+        Look up a list of `(code, codesystem)` pairs at once.
 
-        Can autodetect codesystem or take a codesystem name (as table name in SQLite database) to work with.
+        Codes that aren't cached are fetched with one query per codesystem. Returns
+        the descriptions in the same order, with the same results as `lookup_code`.
+        """
+        metrics = self.metrics
+        database = self._database_key()
+        results = [None] * len(requests)
+        missing = {}  # codesystem -> code -> indexes into results
+
+        for i, (code, codesystem) in enumerate(requests):
+            if code is None or codesystem.startswith("reverse_"):
+                results[i] = self.lookup_code(code, codesystem)
+                continue
+
+            cache_key = (database, codesystem, code)
+            cached = codeCache.codes.get(cache_key)
+            if cached is None and codeCache.missing.get(cache_key):
+                cached = ""
+                if codeTelemetry.recorder is not None:
+                    codeTelemetry.recorder.record_missing(codesystem, code)
+            if cached is not None:
+                results[i] = cached
+                if metrics is not None:
+                    metrics.count("cache_hits")
+            else:
+                missing.setdefault(codesystem, {}).setdefault(code, []).append(i)
+
+        for codesystem, codes in missing.items():
+            if metrics is not None:
+                metrics.count("cache_misses", len(codes))
+            placeholders = ", ".join("?" * len(codes))
+            found = dict(
+                self._query(
+                    codesystem,
+                    f"SELECT code, description FROM {codesystem} "
+                    f"WHERE code IN ({placeholders})",
+                    list(codes),
+                )
+            )
+            for code, indexes in codes.items():
+                cache_key = (database, codesystem, code)
+                if code in found:
+                    codeCache.codes.put(cache_key, found[code])
+                else:
+                    self._record_missing(cache_key, codesystem, code)
+                for i in indexes:
+                    results[i] = found.get(code, "")
+
+        return results
+
+    def _query(self, table, sql, params=()):
+        """
+        Run a query on the code database, returning every row.
+
+        The query is recorded in `metrics` and `codeTelemetry`, if they're on.
+        """
+        recorder = codeTelemetry.recorder
+        if self.metrics is None and recorder is None:
+            return self.db_cursor.execute(sql, params).fetchall()
+
+        start = time.perf_counter()
+        rows = self.db_cursor.execute(sql, params).fetchall()
+        seconds = time.perf_counter() - start
+
+        if self.metrics is not None:
+            self.metrics.count("db_queries")
+            self.metrics.record("db_query", seconds)
+        if recorder is not None:
+            recorder.record_query(table, sql, params, seconds)
+        return rows
+
+    @staticmethod
+    def _record_missing(cache_key, table, code):
+        """
+        Remember that `code` isn't in `table`, so it isn't looked up again.
+        """
+        codeCache.missing.put(cache_key, True)
+        if codeTelemetry.recorder is not None:
+            codeTelemetry.recorder.record_missing(table, code)
+
+    def _get_code_request(self, obj, field="@code", codesystem=None):
+        """
+        Work out the `(code, codesystem)` pair `get_data` would look up.
 
+        Returns `None` if `obj` doesn't have `field`.
         """
         if field not in list(obj.keys()):
-            return "no info"
+            return None
 
         if codesystem is None:  # autodetect
             codesys_raw = obj.get("@codeSystem", None)
@@ -101,23 +684,83 @@ class Parser:
             if codesys_raw is None:  # no info, can't autodetect
                 raise ParserException("must provide codesystem") from None
 
-            r = list(
-                self.db_cursor.execute(
+            database = self._database_key()
+            codesystem = codeCache.codesystems.get((database, codesys_raw))
+
+            if codesystem is None and not codeCache.missing.get(
+                (database, "codesystems", codesys_raw)
+            ):
+                if self.metrics is not None:
+                    self.metrics.count("cache_misses")
+                r = self._query(
+                    "codesystems",
                     "select codesystem_name from codesystems where codesystem_id = ?",
                     (codesys_raw,),
                 )
-            )
-            codesystem = None
-
-            if r:
-                codesystem = r[0][0]
+                if r:
+                    codesystem = r[0][0]
+                    codeCache.codesystems.put((database, codesys_raw), codesystem)
+                else:
+                    codeCache.missing.put((database, "codesystems", codesys_raw), True)
 
             if codesystem is None:
-                raise ParserException("must provide codesystem") from None
+                if codeTelemetry.recorder is not None:
+                    codeTelemetry.recorder.record_missing_codesystem(codesys_raw)
+                raise ParserException(
+                    f"must provide codesystem (unknown OID {codesys_raw})"
+                ) from None
+
+        return obj.get(field, None), codesystem
+
+    def _get_first_request(self, matches, field="@code", codesystem=None):
+        """
+        `_get_code_request` for the first of a list of `extract` matches.
+        """
+        if not matches or not isinstance(matches[0], Mapping):
+            return None
+        return self._get_code_request(matches[0], field, codesystem)
+
+    def _get_first_data(self, matches, field="@code", codesystem=None):
+        """
+        `get_data` for the first of a list of `extract` matches.
+        """
+        if not matches or not isinstance(matches[0], Mapping):
+            return "no info"
+        return self.get_data(matches[0], field, codesystem)
+
+    @cached_property
+    def _header(self):
+        """
+        The `HEADER_SPEC` values, read in one pass.
+        """
+        return HEADER_SPEC.extract(self.patientRole)
+
+    def _get_section_values(self, template_id):
+        """
+        The `SECTION_SPECS` values of a section, read in one pass the first time
+        they're needed. `None` if the document doesn't have the section.
+        """
+        if template_id not in self._section_values:
+            component = self.get_component(template_id=template_id)
+            values = None
+            if component is not None:
+                values = SECTION_SPECS[template_id].extract(component["section"])
+            self._section_values[template_id] = values
+        return self._section_values[template_id]
+
+    def get_data(self, obj, field="@code", codesystem=None):
+        """
+        Get the data from an object with a field.
 
-        # grab code
-        code = obj.get(field, None)
-        # and look up
+        Can autodetect codesystem or take a codesystem name (as table name in SQLite database) to work with.
+
+        """
+        request = self._get_code_request(obj, field, codesystem)
+        if request is None:
+            return "no info"
+
+        # look up the code
+        code, codesystem = request
         data = self.lookup_code(code, codesystem)
 
         return data
@@ -125,61 +768,64 @@ class Parser:
     def _get_vital_codes(self, vital):
         """
         Helper method to get the LOINC codes for a given vital sign.
+
+        The codes are kept in `codeCache.codes` under `(database, "vitals", vital)`.
         """
-        possible_codes = {
-            "Height": ["Height", "Body height"],
-            "Weight": ["Weight", "Body weight"],
-            "BMI": ["Body mass index"],
-            # Add other vitals as needed
-        }
+        cache_key = (self._database_key(), "vitals", vital)
+        codes = codeCache.codes.get(cache_key)
+        if codes is not None:
+            if self.metrics is not None:
+                self.metrics.count("cache_hits")
+            return list(codes)
 
-        descriptions = possible_codes.get(vital, [])
-        codes = []
+        if self.metrics is not None:
+            self.metrics.count("cache_misses")
 
-        with self._connect_db() as conn:
-            cursor = conn.cursor()
-            for description in descriptions:
-                cursor.execute(
-                    "SELECT code FROM loinc WHERE description = ?", (description,)
-                )
-                codes.extend([row[0] for row in cursor.fetchall()])
+        codes = []
+        for description in codeData.vital_descriptions.get(vital, ()):
+            rows = self._query(
+                "loinc", "SELECT code FROM loinc WHERE description = ?", (description,)
+            )
+            codes.extend([row[0] for row in rows])
 
+        codeCache.codes.put(cache_key, tuple(codes))
         return codes
 
-    def get_component(self, name=None, index=None):
+    def get_component(self, name=None, index=None, template_id=None):
         """
-        Get one of the components. Handles a variable number of components and different titles.
+        Get one of the components by title, index or section templateId. Handles a
+        variable number of components and different titles. A templateId also finds
+        a section with the code it implies (see `codeData.section_template_ids`).
 
-        Uses lookup_code to access database and a dict to handle multiple names.
+        Titles are looked up in `codeData.section_codes`, falling back to a reverse
+        LOINC lookup in the database for titles it doesn't know.
 
         Returns `None` if component not found.
         """
+        if template_id is not None:
+            index = self._template_index.get(template_id)
+            if index is None:  # try the section code it implies
+                code = codeData.section_template_ids.get(template_id)
+                index = self._section_index.get(code)
+        elif name is not None:
+            codes = codeData.section_codes.get(name.lower())
+            if codes is None:
+                codes = [self.lookup_code(name, codesystem="reverse_loinc")]
+
+            index = None
+            for code in codes:
+                if code in self._section_index:
+                    index = self._section_index[code]
+                    break
 
-        # multiple possibilites
-        components_possible = {
-            "Vital Signs": [
-                "Vital signs",
-                "Vital signs, weight, height, head circumference, oxygen saturation & BMI panel",
-            ]
-        }
-
-        if name is None:  # use index
-            return self.components[index]
-
-        if name in components_possible:
-            # ok, multiple possibilities
-            for new_name in components_possible[name]:
-                # run through each
-                try:
-                    return self.get_component(name=new_name)
-                except IndexError:
-                    pass  # couldn't find it
-        else:
-            code = self.lookup_code(name, codesystem="reverse_loinc")
-            if code not in self.component_list:  # non existent component
-                return None
-            else:
-                return self.get_component(index=self.component_list.index(code))
+        if index is None:  # non existent component
+            return None
+        if self.metrics is not None and isinstance(
+            self.components, loader.LazySections
+        ):
+            with self.metrics.stage("parse"):  # may load the section
+                return self.components[index]
+        return self.components[index]
 
     def get_latest_vital(self, vital):
         """
@@ -242,6 +888,47 @@ class Parser:
                     obs_unit = observation["value"]["@unit"]
                     return obs_value, obs_unit
 
+    def vitals_table(self, kind="columns"):
+        """
+        Get every observation in the Vital Signs section, read in one pass.
+
+        `kind` is `"columns"` (a dict of lists), `"numpy"` (a structured array) or
+        `"pandas"` (a DataFrame). See `vitals.extract` for the columns.
+        """
+        vital_comp = self.get_component(name="Vital Signs")
+        columns = vitals.extract(vital_comp["section"] if vital_comp else {})
+
+        if kind == "columns":
+            return columns
+        if kind == "numpy":
+            return vitals.to_numpy(columns)
+        if kind == "pandas":
+            return vitals.to_pandas(columns)
+        raise ParserException(f"Invalid table kind {kind}")
+
+    def latest_vitals(self, kind="numpy"):
+        """
+        Get the newest observation of each vital sign, as a structured array or
+        (with `kind="pandas"`) a DataFrame.
+        """
+        if kind not in ("numpy", "pandas"):
+            raise ParserException(f"Invalid table kind {kind}")
+        return vitals.latest(self.vitals_table(kind))
+
+    def _convert(self, value, unit, target):
+        """
+        `units.convert`, timed as the `units` stage if there are metrics.
+        """
+        if self.metrics is None:
+            return units.convert(value, unit, target)
+
+        registries = units.get_registry.cache_info().currsize
+        with self.metrics.stage("units"):
+            value = units.convert(value, unit, target)
+        if units.get_registry.cache_info().currsize != registries:
+            self.metrics.count("unit_registry_builds")
+        return value
+
     # parser methods
 
     def _parse_addr(self, addr):
@@ -308,24 +995,30 @@ class Parser:
             given_name = raw_name["given"]
             family_name = raw_name["family"]
 
-        if isinstance(given_name, dict):
+        if isinstance(given_name, Mapping):
             given_name = given_name.get("#text", "no info")
-        if isinstance(family_name, dict):
+        if isinstance(family_name, Mapping):
             family_name = family_name.get("#text", "no info")
 
         return f"{given_name} {family_name}"
 
-    def _parse_telecoms(self, telecom):
+    @staticmethod
+    def _parse_phone(telecom):
         """
-        Parse telecoms to human-readable formats.
+        Get a telecom's number, without its `tel:` prefix.
         """
+        value = telecom.get("@value")
+        if value is None:
+            return "no info"
+        if value.startswith("tel:"):
+            return value[4:]
+        return value
 
-        if isinstance(telecom, list):  # multiple telecoms
-            telecoms = []
-            for t in telecom:
-                telecoms.append(self._parse_telecoms(t))
-
-        telRaw = self.patientRole["telecom"]["@value"]
+    def _parse_telecoms(self, telecom):
+        """
+        Parse a telecom to a human-readable `[number, use]`.
+        """
+        telRaw = telecom.get("@value", "no info")
         if telRaw.startswith("tel:"):
             tel = telRaw[4:]
         elif telRaw.startswith("mailTo:"):
@@ -333,9 +1026,7 @@ class Parser:
         else:
             tel = telRaw
 
-        telType = self.get_data(
-            self.patientRole["telecom"], field="@use", codesystem="hl7_address_use"
-        )
+        telType = self.get_data(telecom, field="@use", codesystem="hl7_address_use")
 
         return [tel, telType]
 
@@ -347,6 +1038,8 @@ class Parser:
         langCode = entry["languageCode"].get("@code", None)
 
         if langCode is not None:
+            import iso639  # slow to import, so only when there's a language
+
             lang = iso639.Lang(langCode).name
         else:
             lang = "no info"
@@ -358,159 +1051,169 @@ class Parser:
 
         return lang, preferred
 
-    def _parse_smoking_data(self, entry):
-        """
-        Parse a smoking status observation.
-        """
+    # PATIENT DATA FUNCTIONS
 
-        entry = entry["observation"]
-        status = "no info"
-        date = "no info"
-        good = False
+    # The patient properties are worked out on first access and then saved, see
+    # `invalidate`.
 
-        code = entry["code"]["@code"]
-        if code in ["72166-2", "ASSERTION"]:
-            good = True
-            status = self.get_data(entry["value"])
-            date = (
-                entry["effectiveTime"]
-                .get("low", entry["effectiveTime"])
-                .get("@value", "no info")
-            )
-            if date != "no info":
-                date = self._parse_date(date)
+    def demographics(self):
+        """
+        Get all of the patient's header information as a `Demographics` namedtuple.
 
-        return status, date, good
+        Reads the header once and looks up all of its codes together, then saves
+        the values for the matching properties (`name`, `gender`, ...).
+        """
+        header = self._header
+        telecom = extract.first(header["telecom"], {})
+
+        code_requests = [
+            self._get_first_request(header["gender"]),
+            self._get_first_request(header["race"]),
+            self._get_first_request(header["ethnicity"]),
+            self._get_first_request(
+                header["telecom"], field="@use", codesystem="hl7_address_use"
+            ),
+        ]
+        found = iter(self.lookup_codes([r for r in code_requests if r is not None]))
+        gender, race, ethnicity, phone_type = [
+            "no info" if r is None else next(found) for r in code_requests
+        ]
 
-    # PATIENT DATA FUNCTIONS
+        languages = self.languages  # no codes to look up, so use the property
 
-    @property
+        values = {
+            "name": self._parse_name(extract.first(header["name"])),
+            "gender": gender,
+            "dob": self._parse_date(extract.first(header["birth_time"])),
+            "race_ethnicity": (race, ethnicity),
+            "address": self._parse_addr(extract.first(header["addr"], {})),
+            "phone": (self._parse_phone(telecom), phone_type),
+        }
+        self.__dict__.update(values)
+
+        return Demographics(
+            name=values["name"],
+            gender=gender,
+            dob=values["dob"],
+            race=race,
+            ethnicity=ethnicity,
+            languages=languages[0],
+            preferences=languages[1],
+            address=values["address"],
+            phone=values["phone"][0],
+            phone_type=phone_type,
+        )
+
+    @cached_property
     def name(self):
         """
         Retrieve the patient's name.
         """
-        raw_name = self.patient["name"]
-
-        name = self._parse_name(raw_name)
-
-        return name
+        return self._parse_name(extract.first(self._header["name"]))
 
-    @property
+    @cached_property
     def gender(self):
         """
         Retrieve the patient's gender.
         """
+        return self._get_first_data(self._header["gender"])
 
-        return self.get_data(self.patient["administrativeGenderCode"])
-
-    @property
+    @cached_property
     def dob(self):
         """
         Get the patient's date of birth, formatted as MM/DD/YYYY.
         """
+        return self._parse_date(extract.first(self._header["birth_time"]))
 
-        dob_raw = self.patient.get("birthTime", {}).get("@value", "no info")
-        return self._parse_date(dob_raw)
-
-    @property
+    @cached_property
     def race_ethnicity(self):
         """
         Retrieve the patient's race and ethnicity (as a tuple, `(race, ethnicity)`).
         """
-        patientRace = self.get_data(self.patient["raceCode"])
-        patientEthnicity = self.get_data(self.patient["ethnicGroupCode"])
+        patientRace = self._get_first_data(self._header["race"])
+        patientEthnicity = self._get_first_data(self._header["ethnicity"])
 
         return patientRace, patientEthnicity
 
-    @property
+    @cached_property
     def languages(self):
         """
         Return the patient's languages and preferences.
 
         Returns two lists. The first is a list of human-readable language names, and the second is a list of yes/no preferences.
         """
-
         langs, prefs = [], []
+        for entry in self._header["languages"]:
+            lang, pref = self._get_lang_and_pref(entry)
+            langs.append(lang)
+            prefs.append(pref)
+        return langs, prefs
 
-        if isinstance(self.patient["languageCommunication"], dict):
-            lang, pref = self._get_lang_and_pref(self.patient["languageCommunication"])
-            return [lang], [pref]
-        else:
-            for entry in self.patient["languageCommunication"]:
-                lang, pref = self._get_lang_and_pref(entry)
-                langs.extend([lang])
-                prefs.extend([pref])
-            return langs, prefs
-
-    @property
+    @cached_property
     def address(self):
         """
         Retrieve the patient's address.
         Returns a string suitable for printing.
         """
-        addr_raw = self.patientRole["addr"]
-        print(addr_raw)
-        addr = self._parse_addr(addr_raw)
+        return self._parse_addr(extract.first(self._header["addr"], {}))
 
-        return addr
-
-    @property
+    @cached_property
     def phone(self):
         """
         Get the patient's phone and phone type as a tuple.
         """
-        phoneNumber = self.patientRole["telecom"]["@value"][4:]
-        phoneType = self.get_data(
-            self.patientRole["telecom"], field="@use", codesystem="hl7_address_use"
+        telecom = extract.first(self._header["telecom"], {})
+        phoneNumber = self._parse_phone(telecom)
+        phoneType = self._get_first_data(
+            self._header["telecom"], field="@use", codesystem="hl7_address_use"
         )
 
         return phoneNumber, phoneType
 
-    @property
+    @cached_property
     def smoking_status(self):
         """
         Retrieve the patient's smoking status and date.
         """
+        values = self._get_section_values(SOCIAL_HISTORY)
+        if values is None or not values["smoking"]:
+            return "no info", "no info"
 
-        social_comp = self.get_component("Social history")
-        smoking_entries = social_comp["section"]["entry"]
+        observation = SMOKING_SPEC.extract(values["smoking"][0])
+        smoking_status = self._get_first_data(observation["value"])
+        smoking_date = extract.first(observation["low"] or observation["time"])
+        if smoking_date != "no info":
+            smoking_date = self._parse_date(smoking_date)
 
-        smoking_status = "no info"
-        smoking_date = "no info"
-        good = False
+        return smoking_status, smoking_date
 
-        if isinstance(smoking_entries, dict):
-            smoking_status, smoking_date, good = self._parse_smoking_data(
-                smoking_entries
-            )
-        else:
-            for entry in smoking_entries:
-                smoking_status, smoking_date, good = self._parse_smoking_data(entry)
-                if good:
-                    break
+    @cached_property
+    def height_inches(self):
+        """
+        Get the patient's latest height in inches, unrounded.
+        """
+        raw_height, unit = self.get_latest_vital("Height")
+        if raw_height == "no info" or unit == "no info":
+            return "no info"
 
-        return smoking_status, smoking_date
+        return self._convert(float(raw_height), unit, "inches")
 
-    @property
+    @cached_property
     def height(self):
         """
         Get the patient's latest height as a namedtuple with `feet` and `inches` fields.
         """
-        raw_height, unit = self.get_latest_vital("Height")
-        if raw_height == "no info" or unit == "no info":
+        height = self.height_inches
+        if height == "no info":
             return self.height_factory("no info", "no info")
 
-        height = (
-            float(raw_height)
-            * self.ucum_registry.parse_expression(unit).to("inches").magnitude
-        )
         feet, inches = divmod(height, 12)
 
         height = self.height_factory(int(feet), round(inches))
 
         return height
 
-    @property
+    @cached_property
     def weight(self):
         """
         Get the patient's latest weight in pounds.
@@ -519,13 +1222,10 @@ class Parser:
         if raw_weight == "no info" or unit == "no info":
             return "no info"
 
-        weight = (
-            float(raw_weight)
-            * self.ucum_registry.parse_expression(unit).to("pounds").magnitude
-        )
+        weight = self._convert(float(raw_weight), unit, "pounds")
         return round(weight)
 
-    @property
+    @cached_property
     def bmi(self):
         """
         Get the patient's latest BMI.
@@ -538,91 +1238,34 @@ class Parser:
         return round(float(raw_bmi))
 
     def insurance(self):
-        insurance_comp = self.get_component("Payment sources")["section"]
-        if insurance_comp is None:
-            return "no info"
-
-        coverage_acty = insurance_comp["entry"]["act"]
-        policy_acty = coverage_acty["entryRelationship"]["act"]
-
-        performer_oids = [
-            performer["templateId"]["@root"] for performer in policy_acty["performer"]
-        ]
-
-        if (
-            "2.16.840.1.113883.10.20.22.4.87" not in performer_oids
-        ):  # no insurance company info
-            return "no info"
-
-        if "2.16.840.1.113883.10.20.22.4.88" not in performer_oids:  # no gurantor info
-            return "no info"
-
-        company_info = performer_oids.index("2.16.840.1.113883.10.20.22.4.87")
-        gurantor_info = performer_oids.index("2.16.840.1.113883.10.20.22.4.88")
-
-        company_name = self._parse_name(
-            policy_acty["performer"][company_info]["assignedEntity"][
-                "representedOrganization"
-            ]["name"]
-        )
-        company_telecom = self._parse_telecoms(
-            policy_acty["performer"][company_info]["assignedEntity"][
-                "representedOrganization"
-            ]["telecom"]
-        )
-        company_addr = self._parse_addr(
-            policy_acty["performer"][company_info]["assignedEntity"][
-                "representedOrganization"
-            ]["addr"]
-        )
-        print(
-            policy_acty["performer"][company_info]["assignedEntity"][
-                "representedOrganization"
-            ]["addr"]
-        )
-
-        gurantor_name = self._parse_name(
-            policy_acty["performer"][gurantor_info]["assignedEntity"]["assignedPerson"][
-                "name"
-            ]
-        )
-        gurantor_telecom = self._parse_telecoms(
-            policy_acty["performer"][gurantor_info]["assignedEntity"]["telecom"]
-        )
-        gurantor_addr = self._parse_addr(
-            policy_acty["performer"][gurantor_info]["assignedEntity"]["addr"]
-        )
-
-        participant_oids = [
-            participant["templateId"]["@root"]
-            for participant in policy_acty["participant"]
-        ]
-
-        if (
-            "2.16.840.1.113883.10.20.22.4.90" not in participant_oids
-        ):  # no policy holder info
+        """
+        Get the patient's insurance company, guarantor and subscriber ID from the
+        Payers section, or "no info" if any of them is missing.
+        """
+        values = self._get_section_values(PAYERS)
+        if values is None or not (
+            values["company"] and values["guarantor"] and values["subscriber"]
+        ):
             return "no info"
 
-        subscriber_info = participant_oids.index("2.16.840.1.113883.10.20.22.4.90")
-
-        subscriber_id = policy_acty["participant"][subscriber_info]["participantRole"][
-            "id"
-        ]["@extension"]
-
         company_data = {
-            "name": company_name,
-            "addr": company_addr,
-            "telecom": company_telecom,
+            "name": self._parse_name(extract.first(values["company_name"])),
+            "addr": self._parse_addr(extract.first(values["company_addr"], {})),
+            "telecom": self._parse_telecoms(
+                extract.first(values["company_telecom"], {})
+            ),
         }
         gurantor_data = {
-            "name": gurantor_name,
-            "addr": gurantor_addr,
-            "telecom": gurantor_telecom,
+            "name": self._parse_name(extract.first(values["guarantor_name"])),
+            "addr": self._parse_addr(extract.first(values["guarantor_addr"], {})),
+            "telecom": self._parse_telecoms(
+                extract.first(values["guarantor_telecom"], {})
+            ),
         }
 
         out = {
             "company": company_data,
             "gurantor": gurantor_data,
-            "sub_id": subscriber_id,
+            "sub_id": extract.first(values["subscriber_id"]),
         }
         return out
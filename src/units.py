@@ -0,0 +1,159 @@
+"""
+Unit conversions for vital signs.
+
+The common UCUM units are converted with a lookup table. Anything else is
+translated from UCUM's syntax into pint's (`mm[Hg]` to `mmHg`, `m2` to `m**2`,
+with `{annotations}` dropped) and goes through a pint `UnitRegistry`, which is
+only built once per process. pint is slow to import, so it isn't imported until
+a unit needs it.
+
+SI units are always written the way pint writes base units (`kg/m**2`, `1/s`),
+whether they came from the table or from pint, so they can be compared.
+"""
+
+from functools import lru_cache
+import re
+
+# conversion factors from UCUM units, by target unit
+CONVERSIONS = {
+    "inches": {
+        "cm": 1 / 2.54,
+        "m": 100 / 2.54,
+        "in": 1.0,
+        "[in_i]": 1.0,
+        "[in_us]": 1.000002,
+    },
+    "pounds": {
+        "kg": 1 / 0.45359237,
+        "g": 1 / 453.59237,
+        "lb": 1.0,
+        "[lb_av]": 1.0,
+    },
+}
+
+# UCUM units of the common vital signs as (SI unit, factor, offset), with the SI
+# unit as pint would give it
+SI_UNITS = {
+    "cm": ("m", 0.01, 0.0),
+    "m": ("m", 1.0, 0.0),
+    "in": ("m", 0.0254, 0.0),
+    "[in_i]": ("m", 0.0254, 0.0),
+    "[in_us]": ("m", 0.0254000508, 0.0),
+    "kg": ("kg", 1.0, 0.0),
+    "g": ("kg", 0.001, 0.0),
+    "lb": ("kg", 0.45359237, 0.0),
+    "[lb_av]": ("kg", 0.45359237, 0.0),
+    "kg/m2": ("kg/m**2", 1.0, 0.0),
+    "mm[Hg]": ("kg/m/s**2", 133.322387415, 0.0),
+    "/min": ("1/s", 1 / 60, 0.0),
+    "Cel": ("K", 1.0, 273.15),
+    "[degF]": ("K", 5 / 9, 273.15 - 32 * 5 / 9),
+    "%": ("1", 0.01, 0.0),
+    "1": ("1", 1.0, 0.0),
+}
+
+
+# UCUM units whose pint names differ, beyond the exponents `to_pint` rewrites
+PINT_NAMES = {
+    "Cel": "degC",
+    "[degF]": "degF",
+    "mm[Hg]": "mmHg",
+    "cm[H2O]": "cmH2O",
+    "[in_i]": "inch",
+    "[in_us]": "survey_foot / 12",
+    "[ft_i]": "foot",
+    "[lb_av]": "pound",
+    "[oz_av]": "ounce",
+    "[pi]": "pi",
+}
+
+_UCUM_ANNOTATION = re.compile(r"\{[^}]*\}")  # {beats}/min
+
+# a UCUM name to rename, a power of ten (10*3) or an exponent (m2, s-1)
+_UCUM_TOKEN = re.compile(
+    "|".join(re.escape(name) for name in sorted(PINT_NAMES, key=len, reverse=True))
+    + r"|10\*(?=[-+]?\d)|(?<=[A-Za-z\]])[-+]?\d+"
+)
+
+
+def _pint_token(match):
+    token = match.group()
+    if token in PINT_NAMES:
+        return f"({PINT_NAMES[token]})"
+    if token == "10*":
+        return "10**"
+    return "**" + token
+
+
+def to_pint(unit):
+    """
+    Translate a UCUM unit into a pint expression.
+    """
+    unit = _UCUM_ANNOTATION.sub("", unit)
+    unit = _UCUM_TOKEN.sub(_pint_token, unit)
+    if unit.startswith("/"):
+        unit = "1" + unit
+    return unit
+
+
+@lru_cache(maxsize=None)
+def get_registry():
+    """
+    Get the shared pint `UnitRegistry`, creating it on first use.
+    """
+    from pint import UnitRegistry
+
+    return UnitRegistry()
+
+
+def conversion_factor(unit, target):
+    """
+    Get the factor to convert `unit` to `target`.
+
+    Units not in `CONVERSIONS` are looked up with pint and then remembered.
+    """
+    factors = CONVERSIONS.setdefault(target, {})
+    factor = factors.get(unit)
+    if factor is None:
+        factor = get_registry().parse_expression(to_pint(unit)).to(target).magnitude
+        factors[unit] = factor
+    return factor
+
+
+def convert(value, unit, target):
+    """
+    Convert `value` in `unit` to `target`.
+    """
+    return value * conversion_factor(unit, target)
+
+
+def to_si(value, unit):
+    """
+    Convert `value` in `unit` to SI base units, returning `(value, unit)`.
+
+    Units not in `SI_UNITS` go through pint (and are remembered if they convert by
+    a plain factor). Units pint can't handle are returned unchanged.
+    """
+    si = SI_UNITS.get(unit)
+    if si is None:
+        registry = get_registry()
+        expression = to_pint(unit)
+        try:
+            parsed = registry.parse_expression(expression)  # 10*3/uL has a factor
+            scale, units = parsed.magnitude, parsed.units
+            quantity = registry.Quantity(value * scale, units).to_base_units()
+            zero = registry.Quantity(0.0, units).to_base_units().magnitude
+        except (AttributeError, ValueError, TypeError):  # pint errors subclass these
+            return value, unit
+
+        si_unit = f"{quantity.units:~C}" or "1"
+        if zero == 0:
+            SI_UNITS[unit] = (
+                si_unit,
+                registry.Quantity(scale, units).to_base_units().magnitude,
+                0.0,
+            )
+        return quantity.magnitude, si_unit
+
+    si_unit, factor, offset = si
+    return value * factor + offset, si_unit
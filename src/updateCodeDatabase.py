@@ -0,0 +1,248 @@
+"""
+Update a code table in place from a new release, without a full rebuild.
+
+Replaces the refresh half of the old loadLOINCCodes.py. An update has two steps:
+
+1. The new release is staged into `<table>__staged`, committing every
+   `CHUNK_SIZE` rows along with how far it got. An interrupted update picks up
+   where it stopped, as long as the source file hasn't changed.
+2. The staged release is diffed against the live table, and the inserts,
+   updates and deletes are applied to a copy, `<table>__shadow`. The copy is
+   then swapped in for the live table. Step 2 is a single transaction, so
+   readers see either the old table or the new one. They are only blocked
+   while it commits.
+
+The database's `metadata` is updated, so the old `codeSnapshot` stops being
+used, and a new one is written.
+
+Usage::
+
+    python updateCodeDatabase.py --db codeDatabase.db --version 2.77 "Raw Data/Loinc.csv"
+    python updateCodeDatabase.py --table snomed snomed.csv
+"""
+
+import argparse
+from collections import namedtuple
+import datetime
+import hashlib
+import itertools
+import os
+import time
+
+import buildCodeDatabase
+import codeDatabase
+import codeSnapshot
+
+CHUNK_SIZE = 50000
+
+Delta = namedtuple("Delta", "inserted updated deleted")
+
+
+def fingerprint(path):
+    """
+    Hash a source file, so a resumed update can tell it's the same release.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _table_exists(cur, table):
+    row = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    return row is not None
+
+
+def _create_state_table(cur):
+    cur.execute(
+        """CREATE TABLE IF NOT EXISTS update_state (
+        table_name TEXT PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        rows_staged INTEGER NOT NULL
+        ) WITHOUT ROWID;"""
+    )
+
+
+def stage(cur, table, path, reader, chunk_size=CHUNK_SIZE):
+    """
+    Load the release at `path` into `<table>__staged`, resuming an earlier
+    attempt if it was staging the same file. Returns the number of rows read.
+    """
+    staged = f"{table}__staged"
+    digest = fingerprint(path)
+
+    cur.execute("BEGIN IMMEDIATE")
+    _create_state_table(cur)
+    row = cur.execute(
+        "SELECT fingerprint, rows_staged FROM update_state WHERE table_name = ?",
+        (table,),
+    ).fetchone()
+    if row is not None and row[0] == digest and _table_exists(cur, staged):
+        done = row[1]
+    else:  # new release, or nothing to resume
+        done = 0
+        cur.execute(f"DROP TABLE IF EXISTS {staged}")
+        buildCodeDatabase.create_code_table(cur, staged)
+        cur.execute(
+            "INSERT OR REPLACE INTO update_state VALUES (?, ?, 0)", (table, digest)
+        )
+    cur.execute("COMMIT")
+
+    if done:
+        print(f"{table}: resuming after {done} rows")
+
+    rows = itertools.islice(reader(path), done, None)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        cur.execute("BEGIN IMMEDIATE")
+        cur.executemany(f"INSERT OR REPLACE INTO {staged} VALUES (?, ?)", chunk)
+        done += len(chunk)
+        cur.execute(
+            "UPDATE update_state SET rows_staged = ? WHERE table_name = ?",
+            (done, table),
+        )
+        cur.execute("COMMIT")
+
+    return done
+
+
+def diff(cur, table):
+    """
+    Count the codes `<table>__staged` would insert, update and delete.
+    """
+    staged = f"{table}__staged"
+    if not _table_exists(cur, table):
+        inserted = cur.execute(f"SELECT count(*) FROM {staged}").fetchone()[0]
+        return Delta(inserted, 0, 0)
+
+    inserted = cur.execute(
+        f"""SELECT count(*) FROM {staged} AS new
+        WHERE NOT EXISTS (SELECT 1 FROM {table} AS old WHERE old.code = new.code)"""
+    ).fetchone()[0]
+    updated = cur.execute(
+        f"""SELECT count(*) FROM {staged} AS new JOIN {table} AS old USING (code)
+        WHERE old.description IS NOT new.description COLLATE BINARY"""
+    ).fetchone()[0]
+    deleted = cur.execute(
+        f"""SELECT count(*) FROM {table} AS old
+        WHERE NOT EXISTS (SELECT 1 FROM {staged} AS new WHERE new.code = old.code)"""
+    ).fetchone()[0]
+    return Delta(inserted, updated, deleted)
+
+
+def apply(cur, table):
+    """
+    Apply `<table>__staged` to a shadow copy of `table` and swap it in.
+
+    Must be called inside a transaction.
+    """
+    staged = f"{table}__staged"
+    shadow = f"{table}__shadow"
+
+    cur.execute(f"DROP TABLE IF EXISTS {shadow}")
+    buildCodeDatabase.create_code_table(cur, shadow)
+
+    if _table_exists(cur, table):
+        cur.execute(
+            f"INSERT OR REPLACE INTO {shadow} SELECT code, description FROM {table}"
+        )
+        cur.execute(
+            f"""DELETE FROM {shadow} WHERE NOT EXISTS
+            (SELECT 1 FROM {staged} AS new WHERE new.code = {shadow}.code)"""
+        )
+    cur.execute(
+        f"""INSERT OR REPLACE INTO {shadow}
+        SELECT new.code, new.description FROM {staged} AS new
+        LEFT JOIN {shadow} AS old USING (code)
+        WHERE old.code IS NULL
+        OR old.description IS NOT new.description COLLATE BINARY"""
+    )
+
+    cur.execute(f"DROP TABLE IF EXISTS {table}")
+    cur.execute(f"ALTER TABLE {shadow} RENAME TO {table}")
+    buildCodeDatabase.index_code_table(cur, table)
+
+
+def _finish(cur, table):
+    cur.execute(f"DROP TABLE IF EXISTS {table}__staged")
+    cur.execute("DELETE FROM update_state WHERE table_name = ?", (table,))
+
+
+def update(db_path, table, path, version=None, chunk_size=CHUNK_SIZE):
+    """
+    Update `table` in the database at `db_path` to the release at `path`.
+
+    Returns a `Delta` of the codes inserted, updated and deleted. Nothing is
+    swapped (and the snapshot is left alone) if the release has no changes.
+    """
+    reader = buildCodeDatabase.READERS.get(table, buildCodeDatabase.read_codes)
+
+    db = codeDatabase.connect(db_path, read_only=False)
+    db.isolation_level = None
+    cur = db.cursor()
+    try:
+        start = time.perf_counter()
+        count = stage(cur, table, path, reader, chunk_size)
+        print(f"{table}: staged {count} rows in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            delta = diff(cur, table)
+            if any(delta):
+                apply(cur, table)
+
+                buildCodeDatabase.create_metadata_tables(cur)
+                metadata = {
+                    f"source:{table}": os.path.basename(path),
+                    f"updated_at:{table}": datetime.datetime.now(
+                        datetime.timezone.utc
+                    ).isoformat(),
+                }
+                if version is not None:
+                    metadata[f"version:{table}"] = version
+                cur.executemany(
+                    "INSERT OR REPLACE INTO metadata VALUES (?, ?)", metadata.items()
+                )
+                oid = buildCodeDatabase.CODESYSTEMS.get(table)
+                if oid is not None:
+                    cur.execute(
+                        "DELETE FROM codesystems WHERE codesystem_id = ?", (oid,)
+                    )
+                    cur.execute("INSERT INTO codesystems VALUES (?, ?)", (oid, table))
+            _finish(cur, table)
+            cur.execute("COMMIT")
+        except BaseException:
+            cur.execute("ROLLBACK")
+            raise
+        if any(delta):
+            print(f"{table}: {delta} applied in {time.perf_counter() - start:.1f}s")
+            cur.execute(f"ANALYZE {table}")
+        else:
+            print(f"{table}: no changes")
+    finally:
+        db.close()
+
+    if any(delta):
+        codeSnapshot.write(db_path)
+    return delta
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    arg_parser.add_argument("--db", default=codeDatabase.DB_PATH, help="code database")
+    arg_parser.add_argument("--table", default="loinc", help="table to update")
+    arg_parser.add_argument("--version", help="release version, saved in metadata")
+    arg_parser.add_argument("path", help="new release (CSV, or workbook for cdc_rec)")
+    args = arg_parser.parse_args(argv)
+
+    update(args.db, args.table, args.path, args.version)
+
+
+if __name__ == "__main__":
+    main()
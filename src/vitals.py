@@ -0,0 +1,181 @@
+"""
+Vital signs as a columnar table.
+
+`extract` pulls every observation out of a Vital Signs section in one pass. The
+columns can be turned into a NumPy structured array or a pandas DataFrame (if
+they're installed), and `latest` picks the newest row for each code.
+"""
+
+from collections.abc import Mapping
+import math
+import re
+
+import units
+
+COLUMNS = ("code", "name", "time", "value", "unit", "si_value", "si_unit")
+
+
+def _as_list(obj):
+    """
+    Normalize an xmltodict value that may be missing, a dict, or a list of dicts.
+    """
+    if obj is None:
+        return []
+    if isinstance(obj, list):
+        return obj
+    return [obj]
+
+
+def parse_time(ts):
+    """
+    Turn an HL7 timestamp (`YYYYMMDDHHMMSS-ZZZZ`, truncated anywhere after the year)
+    into an ISO 8601 string, ignoring the timezone.
+
+    Returns `None` if there's no usable timestamp.
+    """
+    if not ts:
+        return None
+
+    digits = re.match(r"\d*", ts).group()[:14]
+    if len(digits) < 4:
+        return None
+
+    digits += "0101000000"[len(digits) - 4 :]  # fill in missing month, day, time
+    return (
+        f"{digits[0:4]}-{digits[4:6]}-{digits[6:8]}"
+        f"T{digits[8:10]}:{digits[10:12]}:{digits[12:14]}"
+    )
+
+
+def _effective_time(obj):
+    """
+    Get the `@value` of an `effectiveTime`, or of its `low` if it's an interval.
+    """
+    effective_time = obj.get("effectiveTime")
+    if not isinstance(effective_time, Mapping):
+        return None
+
+    value = effective_time.get("@value")
+    if value is None and isinstance(effective_time.get("low"), Mapping):
+        value = effective_time["low"].get("@value")
+    return value
+
+
+def extract(section):
+    """
+    Read every observation in a Vital Signs section into columns.
+
+    Returns a dict of column name (see `COLUMNS`) to list. `time` is an ISO 8601
+    string, falling back to the organizer's time if the observation has none.
+    `value` and `si_value` are floats (NaN when missing), and `si_value` is the
+    value converted with `units.to_si`.
+    """
+    columns = {name: [] for name in COLUMNS}
+
+    for entry in _as_list(section.get("entry")):
+        organizer = entry.get("organizer")
+        if organizer is None:
+            continue
+        organizer_time = _effective_time(organizer)
+
+        for component in _as_list(organizer.get("component")):
+            observation = component.get("observation")
+            if observation is None:
+                continue
+
+            code = observation.get("code") or {}
+            value = observation.get("value") or {}
+            if isinstance(value, list):
+                value = value[0]
+
+            try:
+                number = float(value.get("@value"))
+            except (TypeError, ValueError):
+                number = math.nan
+            unit = value.get("@unit")
+
+            if unit is None or math.isnan(number):
+                si_value, si_unit = math.nan, None
+            else:
+                si_value, si_unit = units.to_si(number, unit)
+
+            columns["code"].append(code.get("@code"))
+            columns["name"].append(code.get("@displayName"))
+            columns["time"].append(
+                parse_time(_effective_time(observation) or organizer_time)
+            )
+            columns["value"].append(number)
+            columns["unit"].append(unit)
+            columns["si_value"].append(si_value)
+            columns["si_unit"].append(si_unit)
+
+    return columns
+
+
+def _str_column(values):
+    """
+    Replace `None` with empty strings and find the width for a NumPy string field.
+    """
+    values = ["" if value is None else value for value in values]
+    return values, f"U{max(map(len, values), default=0) or 1}"
+
+
+def to_numpy(columns):
+    """
+    Turn columns from `extract` into a NumPy structured array.
+
+    `time` becomes `datetime64[s]` (NaT when missing).
+    """
+    import numpy as np
+
+    data = {}
+    dtype = []
+    for name in COLUMNS:
+        values = columns[name]
+        if name == "time":
+            field_type = "datetime64[s]"
+        elif name in ("value", "si_value"):
+            field_type = "f8"
+        else:
+            values, field_type = _str_column(values)
+        data[name] = values
+        dtype.append((name, field_type))
+
+    table = np.empty(len(columns["code"]), dtype=dtype)
+    for name in COLUMNS:
+        table[name] = np.array(data[name], dtype=table.dtype[name])
+    return table
+
+
+def to_pandas(columns):
+    """
+    Turn columns from `extract` into a pandas DataFrame.
+    """
+    import pandas as pd
+
+    frame = pd.DataFrame({name: columns[name] for name in COLUMNS})
+    frame["time"] = pd.to_datetime(frame["time"])
+    return frame
+
+
+def latest(table):
+    """
+    Get the newest row for each code from a structured array or DataFrame.
+
+    Rows with no time count as the oldest. Uses a sort and group boundary check
+    rather than scanning once per code.
+    """
+    if hasattr(table, "sort_values"):  # DataFrame
+        newest_last = table.sort_values(["code", "time"], na_position="first")
+        return newest_last.drop_duplicates("code", keep="last")
+
+    import numpy as np
+
+    if len(table) == 0:
+        return table
+
+    times = table["time"].astype("int64")  # NaT is the smallest int64
+    order = np.lexsort((times, table["code"]))
+    codes = table["code"][order]
+    group_ends = np.append(codes[1:] != codes[:-1], True)
+    return table[order[group_ends]]
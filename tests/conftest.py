@@ -0,0 +1,27 @@
+"""
+The modules in `src` import each other by name, so put it on the path.
+"""
+
+import glob
+import os
+import sys
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+CCDAS = os.path.join(SRC, "CCDAs")
+
+sys.path.insert(0, SRC)
+
+
+@pytest.fixture
+def samples():
+    """
+    The sample CCDAs that are whole documents (`Payers Section.xml` is only a
+    section).
+    """
+    return [
+        path
+        for path in sorted(glob.glob(os.path.join(CCDAS, "*")))
+        if not path.endswith("Payers Section.xml")
+    ]
@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from conftest import CCDAS
+import batch
+
+SAMPLE = os.path.join(CCDAS, "Sample CCDA 2.xml")
+
+
+@pytest.fixture
+def broken(tmp_path):
+    path = tmp_path / "broken.xml"
+    path.write_text("<ClinicalDocument><recordTarget>")
+    return str(path)
+
+
+@pytest.fixture
+def missing_db(tmp_path):
+    return str(tmp_path / "missing" / "codeDatabase.db")
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_bad_file_only_fails_itself(broken, missing_db, workers):
+    results = list(
+        batch.parse_many(
+            [SAMPLE, broken, SAMPLE],
+            fields=["name", "dob"],
+            workers=workers,
+            db_path=missing_db,
+        )
+    )
+
+    assert [result.path for result in results] == [SAMPLE, broken, SAMPLE]
+    good, bad, again = results
+    assert good.error is None
+    assert good.data == {"name": "Maria Teller", "dob": "12/10/1970"}
+    assert again == good
+    assert bad.data is None
+    assert bad.error.startswith("ParseError")
+
+
+def test_partial_keeps_fields_that_worked(missing_db):
+    (result,) = batch.parse_many(
+        [SAMPLE],
+        fields=["name", "height"],
+        workers=1,
+        db_path=missing_db,
+        partial=True,
+    )
+
+    assert result.data == {"name": "Maria Teller"}
+    assert result.error.startswith("height: OperationalError")
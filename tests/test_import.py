@@ -0,0 +1,5 @@
+import benchmark
+
+
+def test_import_budget():
+    assert benchmark.check_import() == []
@@ -0,0 +1,62 @@
+import glob
+import os
+
+import pytest
+import xmltodict
+
+from conftest import CCDAS
+import loader
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _without_namespaces(value):
+    """
+    `xmltodict.parse`'s output without the `@xmlns` declarations, which the
+    loaders don't keep.
+    """
+    if isinstance(value, dict):
+        return {
+            key: _without_namespaces(item)
+            for key, item in value.items()
+            if not key.startswith("@xmlns")
+        }
+    if isinstance(value, list):
+        return [_without_namespaces(item) for item in value]
+    return value
+
+
+def _components(document):
+    components = document["ClinicalDocument"]["component"]["structuredBody"][
+        "component"
+    ]
+    if isinstance(components, dict):  # a document with one section
+        return [components]
+    return list(components)  # a list, or `loader.LazySections`
+
+
+@pytest.mark.parametrize("path", sorted(glob.glob(os.path.join(CCDAS, "*"))))
+def test_compact_matches_xmltodict(path):
+    data = _read(path)
+    expected = _without_namespaces(xmltodict.parse(data))
+    assert loader.parse_compact(data).to_dict() == expected
+
+
+@pytest.mark.parametrize("mode", ["sections", "streaming"])
+def test_header_and_sections_match_xmltodict(samples, mode):
+    for path in samples:
+        data = _read(path)
+        expected = _without_namespaces(xmltodict.parse(data))
+        if mode == "sections":
+            document = loader.parse_sections(data)
+        else:
+            document = loader.parse_streaming(data)
+
+        assert (
+            document["ClinicalDocument"]["recordTarget"]
+            == expected["ClinicalDocument"]["recordTarget"]
+        ), path
+        assert _components(document) == _components(expected), path
@@ -0,0 +1,45 @@
+import pytest
+
+import units
+
+
+@pytest.mark.parametrize(
+    "unit, expression",
+    [
+        ("mm[Hg]", "(mmHg)"),
+        ("kg/m2", "kg/m**2"),
+        ("s-1", "s**-1"),
+        ("[in_i]2", "(inch)**2"),
+        ("cm[H2O]", "(cmH2O)"),
+        ("10*3/uL", "10**3/uL"),
+        ("/min", "1/min"),
+        ("{beats}/min", "1/min"),
+    ],
+)
+def test_to_pint(unit, expression):
+    assert units.to_pint(unit) == expression
+
+
+@pytest.mark.parametrize("unit", list(units.SI_UNITS))
+def test_table_matches_pint(monkeypatch, unit):
+    pytest.importorskip("pint")
+    expected = [units.to_si(value, unit) for value in (1.0, 37.0)]
+    monkeypatch.delitem(units.SI_UNITS, unit)
+
+    for value, (si_value, si_unit) in zip((1.0, 37.0), expected):
+        assert units.to_si(value, unit) == (pytest.approx(si_value), si_unit)
+
+
+def test_annotations_are_ignored():
+    pytest.importorskip("pint")
+    assert units.to_si(60.0, "{beats}/min") == (pytest.approx(1.0), "1/s")
+
+
+def test_unknown_unit_is_unchanged():
+    pytest.importorskip("pint")
+    assert units.to_si(2.0, "bogus[x]") == (2.0, "bogus[x]")
+
+
+def test_convert():
+    assert units.convert(2.54, "cm", "inches") == pytest.approx(1.0)
+    assert units.convert(1.0, "[lb_av]", "pounds") == 1.0